@@ -0,0 +1,29 @@
+""" Offline benchmarks, run from the repository root, e.g.
+    python3 -m benchmarks.isotp_decode """
+import sys
+import car
+from car.mg_zs_ev import MgZsEv
+
+# Cars with fixtures that are not (yet) in car.Modules
+Unregistered = {'MG_ZS_EV': MgZsEv}
+
+
+def car_class(car_type):
+    """ Return the class of a car, registered or not """
+    if car_type in Unregistered:
+        return Unregistered[car_type]
+    return car.load(car_type)
+
+
+def car_types():
+    """ Return all car types, registered or not """
+    return sorted(car.Modules.keys() | Unregistered.keys())
+
+
+def car_fields(car_type):
+    """ Return the ISO-TP field table used by a car module """
+    for klass in car_class(car_type).__mro__:
+        fields = getattr(sys.modules[klass.__module__], 'Fields', None)
+        if fields is not None:
+            return fields
+    raise ValueError('Car %s has no field table' % car_type)
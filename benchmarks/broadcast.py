@@ -0,0 +1,54 @@
+""" Microbenchmark of the BroadcastDecoder per frame, for repeated and
+    for changing payloads of the FakeDongle broadcast fixtures """
+from argparse import ArgumentParser
+from timeit import Timer
+from car.broadcast_decoder import BroadcastDecoder
+from car.smart_ed import Frames as SmartEdFrames
+from car.zoe import Frames as ZoeFrames
+from dongle.fake_dongle import frames as Fixtures
+
+Cars = {
+    'SMART_ED': SmartEdFrames,
+    'ZOE_Q210': ZoeFrames,
+}
+
+
+def bench_car(car_type, number):
+    """ Returns ns per frame for (repeated, changing) payloads """
+    decoder = BroadcastDecoder(None, Cars[car_type])
+    frames = [(can_id, payload) for can_id, (_, payload) in Fixtures[car_type].items()]
+    # Same frames with the first byte changed, alternating with the originals
+    changed = [(can_id, bytes([payload[0] ^ 0xff]) + payload[1:])
+               for can_id, payload in frames]
+
+    def repeated():
+        for can_id, payload in frames:
+            decoder.decode(can_id, payload)
+
+    def changing():
+        for can_id, payload in frames:
+            decoder.decode(can_id, payload)
+        for can_id, payload in changed:
+            decoder.decode(can_id, payload)
+
+    repeated()
+    t_repeated = Timer(repeated).timeit(number) / (number * len(frames))
+    t_changing = Timer(changing).timeit(number) / (number * 2 * len(frames))
+    return t_repeated * 1e9, t_changing * 1e9
+
+
+def main():
+    """ Run the benchmark for all broadcast cars """
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    parser.add_argument('cars', nargs='*', default=sorted(Cars))
+    args = parser.parse_args()
+
+    for car_type in args.cars:
+        t_repeated, t_changing = bench_car(car_type, args.number)
+        print("%-10s repeated %6.0f ns/frame  changing %6.0f ns/frame" %
+              (car_type, t_repeated, t_changing))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+""" Benchmark of the complete read_dongle cycle of every car module on top
+    of the FakeDongle fixtures. Reports time per decoded field, allocations
+    and peak memory per car. With --compare the ratio against a previous
+    --save result is shown, to compare before and after a change on the same
+    host. The timings vary too much between hosts and runs for a committed
+    baseline or a pass/fail gate. """
+from argparse import ArgumentParser
+from time import perf_counter
+import json
+import tracemalloc
+from dongle.fake_dongle import data as Fixtures, FakeDongle
+from . import car_class, car_types
+
+
+class Watchdog:
+    """ Car is always available """
+
+    @staticmethod
+    def is_car_available():
+        return True
+
+
+class Gps:
+    """ No GPS fix """
+
+    @staticmethod
+    def fix():
+        return None
+
+
+def build_car(car_type):
+    """ Instantiate a car module with a FakeDongle """
+    config = {'type': car_type, 'id': 0, 'interval': 0, 'charge_interval': 0,
+              'isotp': {'layout_cache': None}}
+    return car_class(car_type)(config, FakeDongle({'car_type': car_type}), Watchdog(), Gps())
+
+
+def best_of(func, number, repeat):
+    """ Fastest time per call of func over repeat runs of number calls """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (perf_counter() - start) / number)
+    return best
+
+
+def bench_car(car_type, number, repeat):
+    """ Time read_dongle and IsoTpDecoder.get_data, then measure memory
+        of read_dongle. Returns a dict of results """
+    the_car = build_car(car_type)
+    decoder = the_car._isotp
+
+    # Warm up: learns layouts and fills the refresh schedule
+    the_car.read_dongle({})
+    values = decoder.get_data()
+    arrays = values.get('_arrays', {})
+    fields = len(values) - ('_arrays' in values) + \
+        sum(len(array) for _, _, array in arrays.values())
+
+    t_decode = best_of(decoder.get_data, number, repeat)
+    t_read = best_of(lambda: the_car.read_dongle({}), number, repeat)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    for _ in range(number):
+        the_car.read_dongle({})
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename')
+                   if stat.size_diff > 0)
+
+    return {
+        'fields': fields,
+        'read_us': t_read * 1e6,
+        'decode_us': t_decode * 1e6,
+        'ns_per_field': t_decode * 1e9 / max(1, fields),
+        'peak_kb': peak / 1024,
+        'retained_b': retained / number,
+        }
+
+
+def main():
+    """ Run the benchmark for all cars with fixtures """
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=2000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE', help="write results as JSON")
+    parser.add_argument('--compare', metavar='FILE', help="results written by --save")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="ns/field ratio against --compare that is marked as slower")
+    parser.add_argument('cars', nargs='*', default=car_types())
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    slower = []
+    print("%-12s %6s %10s %10s %9s %9s %11s" %
+          ('car', 'fields', 'read us', 'decode us', 'ns/field', 'peak kB', 'retained B'))
+    for car_type in args.cars:
+        if car_type not in Fixtures:
+            print("%-12s no fixture" % car_type)
+            continue
+
+        result = results[car_type] = bench_car(car_type, args.number, args.repeat)
+        line = "%-12s %6d %10.1f %10.1f %9.0f %9.1f %11.1f" % (
+            car_type, result['fields'], result['read_us'], result['decode_us'],
+            result['ns_per_field'], result['peak_kb'], result['retained_b'])
+
+        if car_type in baseline:
+            ratio = result['ns_per_field'] / baseline[car_type]['ns_per_field']
+            line += "  x%.2f" % ratio
+            if ratio > args.threshold:
+                line += " slower"
+                slower.append(car_type)
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as save_file:
+            json.dump(results, save_file, indent=1)
+
+    if slower:
+        print("Slower than %.2f x %s: %s" % (args.threshold, args.compare, ', '.join(slower)))
+
+
+if __name__ == '__main__':
+    main()
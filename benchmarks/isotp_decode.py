@@ -0,0 +1,62 @@
+""" Microbenchmark comparing the generated IsoTpDecoder decoders with
+    the interpreted field decoder on the FakeDongle fixtures """
+from argparse import ArgumentParser
+from copy import deepcopy
+from timeit import Timer
+from car.isotp_decoder import IsoTpDecoder
+from dongle.fake_dongle import data as Fixtures, FakeDongle
+from dongle import NoData
+from . import car_fields
+
+
+def bench_car(car_type, number):
+    """ Time both decoders for every command with a fixture.
+        Returns a list of (cmd, fields, interpreted ns, generated ns) """
+    dongle = FakeDongle({'car_type': car_type})
+    decoder = IsoTpDecoder(dongle, deepcopy(car_fields(car_type)))
+    results = []
+    for cmd_data in decoder._fields:
+        if cmd_data['computed']:
+            continue
+
+        try:
+            raw = dongle.send_command_ex(cmd_data['cmd'], cmd_data['cantx'],
+                                         cmd_data['canrx'])
+        except NoData:
+            continue
+
+        # First decode learns the value width of simple mode commands
+        expected = decoder._decode(cmd_data, raw)
+        assert IsoTpDecoder._decode_fields(cmd_data, raw) == expected
+
+        generated = cmd_data['decoder']
+        t_interp = Timer(lambda: IsoTpDecoder._decode_fields(cmd_data, raw)).timeit(number)
+        t_gen = Timer(lambda: generated(raw)).timeit(number)
+        results.append((cmd_data['cmd'].hex(), len(cmd_data['fields']),
+                        t_interp / number * 1e9, t_gen / number * 1e9))
+
+    return results
+
+
+def main():
+    """ Run the benchmark for all cars with fixtures """
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=10000)
+    parser.add_argument('cars', nargs='*', default=sorted(Fixtures.keys()))
+    args = parser.parse_args()
+
+    for car_type in args.cars:
+        print(car_type)
+        total_interp = total_gen = 0
+        for cmd, fields, t_interp, t_gen in bench_car(car_type, args.number):
+            total_interp += t_interp
+            total_gen += t_gen
+            print("  %-10s %4d fields  interpreted %8.0f ns  generated %8.0f ns  x%.1f" %
+                  (cmd, fields, t_interp, t_gen, t_interp / t_gen))
+        if total_gen:
+            print("  %-10s %4s         interpreted %8.0f ns  generated %8.0f ns  x%.1f" %
+                  ('total', '', total_interp, total_gen, total_interp / total_gen))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+""" Polling throughput of the car modules on a FakeDongle simulating
+    ECU response times. Compares serial requests with concurrent requests
+    to different ECUs """
+from argparse import ArgumentParser
+from time import perf_counter
+from dongle.fake_dongle import data as Fixtures, FakeDongle
+from . import car_class, car_types
+from .cars import Watchdog, Gps
+
+
+def bench_car(car_type, cycles, latency, concurrent):
+    """ Run read_dongle cycles, returns cycles per second """
+    latency = dict(latency, concurrent=concurrent)
+    config = {'type': car_type, 'id': 0, 'interval': 0, 'charge_interval': 0,
+              'isotp': {'layout_cache': None, 'concurrent': concurrent}}
+    the_car = car_class(car_type)(config, FakeDongle({'car_type': car_type, 'latency': latency}),
+                                  Watchdog(), Gps())
+
+    start = perf_counter()
+    for _ in range(cycles):
+        the_car.read_dongle({})
+    return cycles / (perf_counter() - start)
+
+
+def main():
+    """ Run the benchmark for all cars with fixtures """
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--cycles', type=int, default=20)
+    parser.add_argument('--base', type=float, default=.01, help="response time in s")
+    parser.add_argument('--frame', type=float, default=.0005, help="time per CAN frame in s")
+    parser.add_argument('--jitter', type=float, default=.005)
+    parser.add_argument('--nodata', type=float, default=0, help="probability of no answer")
+    parser.add_argument('--timeout', type=float, default=.2)
+    parser.add_argument('cars', nargs='*', default=car_types())
+    args = parser.parse_args()
+
+    latency = {'base': args.base, 'frame': args.frame, 'jitter': args.jitter,
+               'nodata': args.nodata, 'timeout': args.timeout, 'seed': 0}
+
+    print("%-12s %20s %20s" % ('car', 'serial cycles/s', 'concurrent cycles/s'))
+    for car_type in args.cars:
+        if car_type not in Fixtures:
+            print("%-12s no fixture" % car_type)
+            continue
+
+        serial = bench_car(car_type, args.cycles, latency, False)
+        concurrent = bench_car(car_type, args.cycles, latency, True)
+        print("%-12s %20.2f %20.2f" % (car_type, serial, concurrent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+""" Generic decoder for cars broadcasting their data on the CAN bus """
+import logging
+from copy import deepcopy
+from struct import Struct
+from threading import Lock
+from time import monotonic
+from .isotp_decoder import prepare_bits, bits_expr, order_computed
+
+# struct format by width and signedness, 3 byte values are unpacked as
+# a byte and a short and combined in the expression
+WidthFormats = {
+    1: ('B', 'b'),
+    2: ('H', 'h'),
+    3: ('BH', 'bH'),
+    4: ('I', 'i'),
+    8: ('Q', 'q'),
+}
+
+
+def build_frame_decoder(frame):
+    """ Generate a function returning a dict of all scaled values of one
+        frame. Every byte range is unpacked once with a single struct,
+        fields sharing a range only differ in shift and mask. """
+    ranges = set()
+    for field in frame['fields']:
+        prepare_bits(field)
+        field['width'] = field.get('width', 1)
+        field['signed'] = field.get('signed', False)
+        field['scale'] = field.get('scale', 1)
+        field['offset'] = field.get('offset', 0)
+        ranges.add((field['pos'], field['width'], field['signed']))
+
+    fmt = '>'
+    end = 0
+    idx = 0
+    exprs = {}
+    for pos, width, signed in sorted(ranges):
+        if pos < end:
+            raise ValueError('Overlapping fields at byte %d of frame 0x%x' %
+                             (pos, frame['can_id']))
+        fmt += 'x' * (pos - end) + WidthFormats[width][signed]
+        if width == 3:
+            exprs[(pos, width, signed)] = '(v[%d] << 16 | v[%d])' % (idx, idx + 1)
+            idx += 2
+        else:
+            exprs[(pos, width, signed)] = 'v[%d]' % idx
+            idx += 1
+        end = pos + width
+
+    frame['struct'] = Struct(fmt)
+    namespace = {'unpack_from': frame['struct'].unpack_from}
+    values = []
+    for idx, field in enumerate(frame['fields']):
+        value = exprs[(field['pos'], field['width'], field['signed'])]
+        if 'lambda' in field:
+            # Applied to the unpacked range before shift, mask and scale,
+            # e.g. to combine bytes that are not adjacent
+            namespace['l%d' % idx] = field['lambda']
+            value = 'l%d(%s)' % (idx, value)
+        value = bits_expr(field, value)
+        if field['scale'] != 1:
+            value += ' * %r' % field['scale']
+        if field['offset'] != 0:
+            value += ' + %r' % field['offset']
+        values.append('        %r: %s,' % (field['name'], value))
+
+    source = '\n'.join(['def decode(msg):',
+                        '    v = unpack_from(msg)',
+                        '    return {'] + values + ['    }'])
+    exec(compile(source, '<frame 0x%x>' % frame['can_id'], 'exec'), namespace)
+    return namespace['decode']
+
+
+def frame_data_mask(frame):
+    """ Return the 8 byte mask of all payload bits used by the fields of a
+        prepared frame """
+    data_mask = bytearray(8)
+    for field in frame['fields']:
+        pos, width = field['pos'], field['width']
+        bits = (1 << 8 * width) - 1
+        if 'lambda' in field:
+            # Shift and mask apply to the result, any bit may be used
+            pass
+        elif field['mask'] is not None:
+            bits &= field['mask'] << field['shift']
+        else:
+            bits = bits >> field['shift'] << field['shift']
+        for idx, byte in enumerate(bits.to_bytes(width, 'big'), pos):
+            data_mask[idx] |= byte
+    return bytes(data_mask)
+
+
+class BroadcastDecoder:
+    """ Decodes raw frames by can_id into signals. Frames with the same
+        payload as last time are skipped, computed fields are only
+        evaluated when one of their inputs changed.
+        Frames can be decimated: with 'every' only every Nth frame of an id
+        is decoded, with 'interval' (in seconds) at most one per interval.
+        The latest frame held back by 'interval' is decoded by get_data. """
+
+    def __init__(self, dongle, frames):
+        self._log = logging.getLogger("EVNotiPi/Broadcast-Decoder")
+        self._dongle = dongle
+        self._frames = {}
+        self._data = {}
+        self._lock = Lock()
+        # The tables are annotated in place, car modules share them
+        frames = deepcopy(frames)
+        for frame in frames:
+            if frame.get('computed', False):
+                continue
+            frame['decoder'] = build_frame_decoder(frame)
+            frame['raw'] = None
+            frame['every'] = frame.get('every', 0)
+            frame['count'] = 0
+            frame['interval'] = frame.get('interval', 0)
+            frame['next'] = 0
+            frame['pending'] = None
+            self._frames[frame['can_id']] = frame
+        self._interval_frames = [frame for frame in self._frames.values() if frame['interval']]
+        # Computed fields depending on the signals of each frame, in order
+        computed = order_computed(frames)
+        for frame in self._frames.values():
+            names = {field['name'] for field in frame['fields']}
+            frame['derived'] = []
+            for field in computed:
+                if not names.isdisjoint(field['inputs']):
+                    frame['derived'].append(field)
+                    names.add(field['name'])
+
+    def get_filters(self):
+        """ Return raw filters passing all decoded frames. They include the
+            payload bits the frame is decoded from ('data_mask') and its
+            interval ('throttle') for dongles filtering by content. """
+        filters = []
+        for can_id, frame in self._frames.items():
+            flt = {'id': can_id,
+                   'mask': frame.get('mask', 0x7ff if can_id <= 0x7ff else 0x1fffffff),
+                   'data_mask': frame_data_mask(frame)}
+            if frame['interval']:
+                flt['throttle'] = frame['interval']
+            filters.append(flt)
+        return filters
+
+    def decode(self, can_id, msg):
+        """ Decode one frame. Returns the names of changed signals. """
+        frame = self._frames.get(can_id)
+        if frame is None:
+            return ()
+
+        if frame['every']:
+            frame['count'] += 1
+            if frame['count'] < frame['every']:
+                return ()
+            frame['count'] = 0
+
+        with self._lock:
+            if frame['interval']:
+                now = monotonic()
+                if now < frame['next']:
+                    frame['pending'] = msg
+                    return ()
+                frame['next'] = now + frame['interval']
+                frame['pending'] = None
+
+            return self._decode(frame, msg)
+
+    def _decode(self, frame, msg):
+        """ Decode a frame and update computed fields, with the lock held """
+        if msg == frame['raw']:
+            return ()
+
+        if len(msg) < frame['struct'].size:
+            self._log.debug("Short frame can_id(%x) msg(%s)", frame['can_id'], msg.hex())
+            return ()
+        frame['raw'] = msg
+
+        data = self._data
+        changed = set()
+        for name, value in frame['decoder'](msg).items():
+            if data.get(name) != value:
+                data[name] = value
+                changed.add(name)
+
+        if changed:
+            for field in frame['derived']:
+                if changed.isdisjoint(field['inputs']):
+                    continue
+                try:
+                    value = field['lambda'](data)
+                except KeyError:
+                    continue
+                if data.get(field['name']) != value:
+                    data[field['name']] = value
+                    changed.add(field['name'])
+
+        return changed
+
+    def read_frame(self, timeout=None):
+        """ Read one frame from the dongle and decode it.
+            Returns the names of changed signals. """
+        frame = self._dongle.read_raw_frame(timeout)
+        return self.decode(frame['can_id'], frame['data'])
+
+    def read_frames(self, timeout=None):
+        """ Read and decode all pending frames, waiting up to timeout for
+            the first one. Uses the bulk read of the dongle if it has one.
+            Returns the names of changed signals. """
+        read_raw_frames = getattr(self._dongle, 'read_raw_frames', None)
+        if read_raw_frames is None:
+            return self.read_frame(timeout)
+
+        changed = set()
+        decode = self.decode
+        for can_id, dlc, _, msg, _ in read_raw_frames(timeout).tolist():
+            changed.update(decode(can_id, msg[:dlc]))
+        return changed
+
+    def get_data(self):
+        """ Return the current value of all signals """
+        with self._lock:
+            for frame in self._interval_frames:
+                if frame['pending'] is not None:
+                    self._decode(frame, frame['pending'])
+                    frame['pending'] = None
+            return dict(self._data)
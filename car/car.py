@@ -26,6 +26,16 @@ def ffbs(in_bytes):
     return float(int.from_bytes(in_bytes, byteorder='big', signed=True))
 
 
+def flatten_arrays(arrays):
+    """ Expand array fields (see IsoTpDecoder) into one key per element """
+    flat = {}
+    for pattern, first, values in arrays.values():
+        for idx, value in enumerate(values.tolist(), first):
+            if value == value:  # skip NaN
+                flat[pattern % idx] = value
+    return flat
+
+
 class DataError(ValueError):
     """ Problem with data occured """
 
@@ -71,6 +81,9 @@ class Car:
         self._running = False
         self.last_data = monotonic()
         self._data_callbacks = []
+        self._flat_array_callbacks = set()
+        # IsoTpDecoder of the subclass, if any
+        self._isotp = None
         self.is_available = watchdog.is_car_available
         self._can_tries = max(1, self._config.get('can_tries', 3))
 
@@ -88,6 +101,8 @@ class Car:
         """ Stop the poller thread. """
         self._running = False
         self._thread.join()
+        if self._isotp is not None:
+            self._isotp.close()
 
     def poll_data(self):
         """ The poller thread. """
@@ -129,6 +144,10 @@ class Car:
                 if self._skip_polling:
                     log.info("Resume polling.")
                     self._skip_polling = False
+                    if self._isotp is not None:
+                        # Cached and carried over values may be stale
+                        # after car off
+                        self._isotp.invalidate_cache()
 
                 try:
                     self.read_dongle(data)  # readDongle updates data inplace
@@ -193,8 +212,17 @@ class Car:
                     'emergencyThreshold':       thresholds['emergency'],
                 })
 
+            # Array fields are only expanded for callbacks that asked for them
+            arrays = data.pop('_arrays', None)
+            flat_data = None
             for call_back in self._data_callbacks:
-                call_back(data)
+                if arrays and call_back in self._flat_array_callbacks:
+                    if flat_data is None:
+                        flat_data = dict(data)
+                        flat_data.update(flatten_arrays(arrays))
+                    call_back(flat_data)
+                else:
+                    call_back(data)
 
             if self._running:
                 if data['charging']:
@@ -209,14 +237,27 @@ class Car:
                     # Limit poll rate if polling shall be skipped
                     sleep(1)
 
-    def register_data(self, callback):
-        """ Register a callback that get called with new data. """
+    def register_data(self, callback, flat_arrays=False):
+        """ Register a callback that get called with new data.
+            If flat_arrays is set, array fields (i.e. cell voltages) are
+            passed as one key per element. """
         if callback not in self._data_callbacks:
             self._data_callbacks.append(callback)
+        if flat_arrays:
+            self._flat_array_callbacks.add(callback)
 
     def unregister_data(self, callback):
         """ Unregister a callback. """
         self._data_callbacks.remove(callback)
+        self._flat_array_callbacks.discard(callback)
+
+    def get_field_times(self):
+        """ Return the wall clock time every field of the last data was
+            received from the car, for fields decoded by an IsoTpDecoder.
+            data['timestamp'] is the start of the polling cycle. """
+        if self._isotp is None:
+            return {}
+        return self._isotp.get_field_times()
 
     def check_thread(self):
         """ Return state of thread. """
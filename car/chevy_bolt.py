@@ -90,7 +90,8 @@ class IoniqBev(Car):
     def __init__(self, config, dongle, watchdog, gps):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_11_500')
-        self._isotp = IsoTpDecoder(self._dongle, Fields)
+        self._isotp = IsoTpDecoder(self._dongle, Fields, config.get('isotp'),
+                                  car_type=config.get('type'))
 
     def read_dongle(self, data):
         """ Fetch data from CAN-bus and decode it.
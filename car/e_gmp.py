@@ -20,12 +20,13 @@ Fields = (
     {'cmd': '220101', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
      'fields': [
          {'pos': 'e', 'name': 'SOC_BMS', 'width': 1, 'scale': .5},
-         {'pos': 'j', 'name': '_charging_bits1', 'width': 1},
+         {'pos': 'j', 'name': 'normalChargePort', 'width': 1, 'bit': 4},
+         {'pos': 'j', 'name': 'rapidChargePort', 'width': 1, 'mask': 0x30, 'any': True},
          {'pos': 'k', 'name': 'dcBatteryCurrent', 'width': 2, 'signed': True, 'scale': .1},
          {'pos': 'm', 'name': 'dcBatteryVoltage', 'width': 2, 'scale': .1},
          {'pos': 'o', 'name': 'batteryMaxTemperature', 'width': 1, 'signed': True},
          {'pos': 'p', 'name': 'batteryMinTemperature', 'width': 1, 'signed': True},
-         {'pos': 'q', 'name': 'cellTemp%02d', 'idx': 1, 'cnt': 5, 'width': 1, 'signed': True},
+         {'pos': 'q', 'name': 'cellTemp%02d', 'idx': 1, 'cnt': 5, 'width': 1, 'signed': True, 'array': True, 'stats': ()},
          {'pos': 'x', 'name': 'maxCellVoltage', 'width': 1, 'scale': .02},
          {'pos': 'y', 'name': 'maxCellVoltNo', 'width': 1},
          {'pos': 'z', 'name': 'minCellVoltage', 'width': 1, 'scale': .02},
@@ -40,34 +41,34 @@ Fields = (
          {'pos': 'bb', 'name': 'driveMotorSpeed1', 'width': 2, 'signed': True},
          {'pos': 'bd', 'name': 'driveMotorSpeed2', 'width': 2, 'signed': True},
          ]},
-    #{'cmd': '220102', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
-    #'fields': [
-    #    {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 1, 'cnt': 32, 'width': 1, 'scale': .02},
-    #    ]},
-    #{'cmd': '220103', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
-    #'fields': [
-    #    {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 33, 'cnt': 32, 'width': 1, 'scale': .02},
-    #    ]},
-    #{'cmd': '220104', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
-    #'fields': [
-    #    {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 65, 'cnt': 32, 'width': 1, 'scale': .02},
-    #    ]},
+    {'cmd': '220102', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True, 'refresh': 30, 'optional': True,
+     'fields': [
+         {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 1, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
+         ]},
+    {'cmd': '220103', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True, 'refresh': 30, 'optional': True,
+     'fields': [
+         {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 33, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
+         ]},
+    {'cmd': '220104', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True, 'refresh': 30, 'optional': True,
+     'fields': [
+         {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 65, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
+         ]},
     {'cmd': '220105', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
      'fields': [
-         {'pos': 'j', 'name': 'cellTemp%02d', 'idx': 6, 'cnt': 7, 'width': 1, 'signed': True},
+         {'pos': 'j', 'name': 'cellTemp%02d', 'idx': 6, 'cnt': 7, 'width': 1, 'signed': True, 'array': True, 'stats': ()},
          {'pos': 'q', 'name': 'availableChargePower', 'width': 2, 'scale': .01},
          {'pos': 's', 'name': 'availableDischargePower', 'width': 2, 'scale': .01},
          {'pos': 'x', 'name': 'batteryInletTemperature', 'width': 1, 'signed': True},
          {'pos': 'z', 'name': 'soh', 'width': 2, 'scale': .1},
          {'pos': 'ac', 'name': 'energyRemaining', 'width': 2, 'scale': 2},
          {'pos': 'af', 'name': 'SOC_DISPLAY', 'width': 1, 'scale': .5},
-         {'pos': 'an', 'name': 'cellTemp%02d', 'idx': 13, 'cnt': 4, 'width': 1, 'signed': True},
+         {'pos': 'an', 'name': 'cellTemp%02d', 'idx': 13, 'cnt': 4, 'width': 1, 'signed': True, 'array': True, 'stats': ()},
          ]},
     {'cmd': '220106', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
      'fields': [
          {'pos': 'd', 'name': 'coolant2Temperature', 'width': 1, 'signed': True},
          {'pos': 'm', 'name': 'acCompressorRPM', 'width': 1, 'scale': 20},
-         #{'pos': 'o', 'name': '_battBits', 'width': 1},
+         #{'pos': 'o', 'name': 'battThermalMode', 'width': 1, 'bits': 4},
          # bit 0-3
          # LTR		3	0011
          # COOL		4	0100
@@ -78,23 +79,24 @@ Fields = (
      'fields': [
          {'pos': 'u', 'name': 'auxBatterySoC', 'width': 1},
          ]},
-     #{'cmd': '22010a', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
-    #'fields': [
-    #    {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 97, 'cnt': 32, 'width': 1, 'scale': .02},
-    #    ]},
-    #{'cmd': '22010b', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
-    # 'fields': [
-    #     {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 129, 'cnt': 32, 'width': 1, 'scale': .02},
-    #     ]},
-    #{'cmd': '22010c', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True,
-    # 'fields': [
-    #     {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 161, 'cnt': 32, 'width': 1, 'scale': .02},
-    #     ]},
-    {'cmd': '22b002', 'canrx': 0x7ce, 'cantx': 0x7c6, 'optional': True, 'absolute': True,
+    # Not all variants have 192 cells
+    {'cmd': '22010a', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True, 'refresh': 30, 'optional': True,
+     'fields': [
+         {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 97, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
+         ]},
+    {'cmd': '22010b', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True, 'refresh': 30, 'optional': True,
+     'fields': [
+         {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 129, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
+         ]},
+    {'cmd': '22010c', 'canrx': 0x7ec, 'cantx': 0x7e4, 'absolute': True, 'refresh': 30, 'optional': True,
+     'fields': [
+         {'pos': 'e', 'name': 'cellVoltage%03d', 'idx': 161, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
+         ]},
+    {'cmd': '22b002', 'canrx': 0x7ce, 'cantx': 0x7c6, 'optional': True, 'absolute': True, 'refresh': 60,
      'fields': [
          {'pos': 'g', 'name': 'odo', 'width': 3},
          ]},
-     {'cmd': '22c00b', 'canrx': 0x7a8, 'cantx': 0x7a0, 'optional': True, 'absolute': True,
+     {'cmd': '22c00b', 'canrx': 0x7a8, 'cantx': 0x7a0, 'optional': True, 'absolute': True, 'refresh': 60,
       'fields': [
           {'pos': 'e', 'name': 'tire_fl_pres', 'width': 1, 'scale': 0.2/14.504},
           {'pos': 'f', 'name': 'tire_fl_temp', 'width': 1, 'offset': -50},
@@ -109,14 +111,8 @@ Fields = (
        'fields': (
            {'name': 'dcBatteryPower',
             'lambda': lambda d: d['dcBatteryCurrent'] * d['dcBatteryVoltage'] / 1000.0},
-           {'name': 'normalChargePort',
-            'lambda': lambda d: int(d['_charging_bits1'] & 0x10 != 0)},
-           {'name': 'rapidChargePort',
-            'lambda': lambda d: int(d['_charging_bits1'] & (0x10 | 0x20) != 0)},
            {'name': 'charging',
             'lambda': lambda d: d['normalChargePort'] or d['rapidChargePort']},
-           #{'name': 'battThermalMode',
-           # 'lambda': lambda d: d['_battBits'] & 0xf},
            )
        },
 )
@@ -128,7 +124,8 @@ class E_GMP(Car):
     def __init__(self, config, dongle, watchdog, gps):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_11_500')
-        self._isotp = IsoTpDecoder(self._dongle, Fields)
+        self._isotp = IsoTpDecoder(self._dongle, Fields, config.get('isotp'),
+                                  car_type=config.get('type'))
         self._avg_wheel_speed = RollingAverage(int(600/max(1, self._poll_interval)))
         self._avg_gps_speed = RollingAverage(int(600/max(1, self._poll_interval)))
         self._motor_speed_divider = config.get('motor_speed_devider', 278)
@@ -139,11 +136,11 @@ class E_GMP(Car):
         data.update(self.get_base_data())
         data.update(self._isotp.get_data(self._can_tries))
 
+        _, _, temps = data['_arrays']['cellTemp']
         temp_sum = 0
         temp_cnt = 0
-        for i in range(1, 17):
-            temp = data['cellTemp%02d' % i]
-            temp_cnt = i
+        for temp in temps.tolist():
+            temp_cnt += 1
             if temp > 0:
                 temp_sum += temp
             else:
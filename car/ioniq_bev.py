@@ -18,12 +18,15 @@ Fields = (
          {'name': 'SOC_BMS', 'width': 1, 'scale': .5},                              # e
          {'name': 'availableChargePower', 'width': 2, 'scale': .01},                # f,g
          {'name': 'availableDischargePower', 'width': 2, 'scale': .01},             # h,i
-         {'name': 'bmsBits1', 'width': 1},                                          # j
+         {'name': 'charging', 'width': 1, 'bit': 7},                                # j
+         {'name': 'normalChargePort', 'bit': 5},
+         {'name': 'rapidChargePort', 'bit': 6},
          {'name': 'dcBatteryCurrent', 'width': 2, 'signed': True, 'scale': .1},     # k,l
          {'name': 'dcBatteryVoltage', 'width': 2, 'scale': .1},                     # m,n
          {'name': 'batteryMaxTemperature', 'width': 1, 'signed': True},             # o
          {'name': 'batteryMinTemperature', 'width': 1, 'signed': True},             # p
-         {'name': 'cellTemp%02d', 'idx': 1, 'cnt': 5, 'width': 1, 'signed': True},  # q,r,s,t,u
+         {'name': 'cellTemp%02d', 'idx': 1, 'cnt': 5, 'width': 1, 'signed': True, 'array': True,
+          'stats': ('Mean',)},                                                     # q-u
          {'padding': 1},                                                            # v
          {'name': 'batteryInletTemperature', 'width': 1, 'signed': True},           # w
          {'name': 'maxCellVoltage', 'width': 1, 'scale': 0.02},                     # x
@@ -46,31 +49,32 @@ Fields = (
          # Len: 61
      )
      },
-    {'cmd': b2102, 'canrx': 0x7ec, 'cantx': 0x7e4,
+    {'cmd': b2102, 'canrx': 0x7ec, 'cantx': 0x7e4, 'refresh': 30,
      'fields': (
          {'padding': 6},
-         {'name': 'cellVoltage%02d', 'idx': 1, 'cnt': 32, 'width': 1, 'scale': .02},
+         {'name': 'cellVoltage%02d', 'idx': 1, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
          # Len: 38
      )
      },
-    {'cmd': b2103, 'canrx': 0x7ec, 'cantx': 0x7e4,
+    {'cmd': b2103, 'canrx': 0x7ec, 'cantx': 0x7e4, 'refresh': 30,
      'fields': (
          {'padding': 6},
-         {'name': 'cellVoltage%02d', 'idx': 33, 'cnt': 32, 'width': 1, 'scale': .02},
+         {'name': 'cellVoltage%02d', 'idx': 33, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
          # Len: 38
      )
      },
-    {'cmd': b2104, 'canrx': 0x7ec, 'cantx': 0x7e4,
+    {'cmd': b2104, 'canrx': 0x7ec, 'cantx': 0x7e4, 'refresh': 30,
      'fields': (
          {'padding': 6},
-         {'name': 'cellVoltage%02d', 'idx': 65, 'cnt': 32, 'width': 1, 'scale': .02},
+         {'name': 'cellVoltage%02d', 'idx': 65, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
          # Len: 38
      )
      },
     {'cmd': b2105, 'canrx': 0x7ec, 'cantx': 0x7e4,
      'fields': (
          {'padding': 11},                                               # _,_,a,b,c,d,e,f,g,h,i
-         {'name': 'cellTemp%02d', 'idx': 6, 'cnt': 7, 'width': 1, 'signed': True},  # j,k,l,m,n,o,p
+         {'name': 'cellTemp%02d', 'idx': 6, 'cnt': 7, 'width': 1, 'signed': True, 'array': True,
+          'stats': ('Mean',)},                                                   # j-p
          {'padding': 4},                                                        # q,r,s,t
          {'name': 'cellVoltageDeviation', 'width': 1, 'scale': 0.02},           # u
          {'padding': 1},                                                        # v
@@ -94,7 +98,7 @@ Fields = (
          # Len: 25
      )
      },
-    {'cmd': b22b002, 'canrx': 0x7ce, 'cantx': 0x7c6, 'optional': True,
+    {'cmd': b22b002, 'canrx': 0x7ce, 'cantx': 0x7c6, 'optional': True, 'refresh': 60,
      'fields': (
          {'padding': 9},                # _,_,a,b,c,d,e,f
          {'name': 'odo', 'width': 3},   # g,h,i
@@ -102,7 +106,7 @@ Fields = (
          # Len: 15
      )
      },
-    {'cmd': b22c00b, 'canrx': 0x7a8, 'cantx': 0x7a0, 'optional': True,
+    {'cmd': b22c00b, 'canrx': 0x7a8, 'cantx': 0x7a0, 'optional': True, 'refresh': 60,
      'fields': (
          {'padding': 7},                # _,_,a,b,c,d,e
          {'name': 'tire_fl_pres', 'width': 1, 'scale': 0.2/14.504},
@@ -122,8 +126,13 @@ Fields = (
     {'cmd': b2101, 'canrx': 0x7ea, 'cantx': 0x7e2,
      'fields': (
          {'padding': 7},
-         {'name': 'gearBits', 'width': 1},    # f
-         {'name': 'brakeBits', 'width': 1},   # g
+         {'name': 'isParked', 'width': 1, 'bit': 0},  # f
+         {'name': 'vmcu_gear_p', 'bit': 0},
+         {'name': 'vmcu_gear_r', 'bit': 1},
+         {'name': 'vmcu_gear_n', 'bit': 2},
+         {'name': 'vmcu_gear_d', 'bit': 3},
+         {'name': 'vmcu_brake_lamp', 'width': 1, 'bit': 0},  # g
+         {'name': 'vmcu_brake_on', 'bit': 1},
          {'padding': 5},
          {'name': 'vmcu_accel', 'width': 1},  # l
          {'padding': 1},
@@ -134,26 +143,6 @@ Fields = (
      'fields': (
          {'name': 'dcBatteryPower',
           'lambda': lambda d: d['dcBatteryCurrent'] * d['dcBatteryVoltage'] / 1000.0},
-         {'name': 'charging',
-          'lambda': lambda d: int(d['bmsBits1'] & 0x80 != 0)},
-         {'name': 'normalChargePort',
-          'lambda': lambda d: int(d['bmsBits1'] & 0x20 != 0)},
-         {'name': 'rapidChargePort',
-          'lambda': lambda d: int(d['bmsBits1'] & 0x40 != 0)},
-         {'name': 'isParked',
-          'lambda': lambda d: int(d['gearBits'] & 0b0001 != 0)},
-         {'name': 'vmcu_gear_p',
-          'lambda': lambda d: int(d['gearBits'] & 0b0001 != 0)},
-         {'name': 'vmcu_gear_r',
-          'lambda': lambda d: int(d['gearBits'] & 0b0010 != 0)},
-         {'name': 'vmcu_gear_n',
-          'lambda': lambda d: int(d['gearBits'] & 0b0100 != 0)},
-         {'name': 'vmcu_gear_d',
-          'lambda': lambda d: int(d['gearBits'] & 0b1000 != 0)},
-         {'name': 'vmcu_brake_lamp',
-          'lambda': lambda d: int(d['brakeBits'] & 0b01 != 0)},
-         {'name': 'vmcu_brake_on',
-          'lambda': lambda d: int(d['brakeBits'] & 0b10 != 0)},
          {'name': 'wheelSpeed',
           'lambda': lambda d: d['driveMotorSpeed1'] / 255},  # 255 -> m/s
      )
@@ -167,7 +156,8 @@ class IoniqBev(Car):
     def __init__(self, config, dongle, watchdog, gps):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_11_500')
-        self._isotp = IsoTpDecoder(self._dongle, Fields)
+        self._isotp = IsoTpDecoder(self._dongle, Fields, config.get('isotp'),
+                                  car_type=config.get('type'))
 
     def read_dongle(self, data):
         """ Fetch data from CAN-bus and decode it.
@@ -177,12 +167,7 @@ class IoniqBev(Car):
         data.update(self.get_base_data())
         data.update(self._isotp.get_data())
 
-        temp = 0
-        for i in range(1, 13):
-            temp += data['cellTemp%02d' % i]
-
-        temp /= 12
-        data['batteryAvgTemperature'] = temp
+        data['batteryAvgTemperature'] = data['cellTempMean']
 
     def get_base_data(self):
         return {
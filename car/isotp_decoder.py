@@ -1,7 +1,15 @@
 """ Generic decoder for ISO-TP based cars """
 import logging
 import struct
-from dongle import NoData
+import json
+import os
+from bisect import bisect_left
+from math import sqrt
+from copy import deepcopy
+from time import monotonic, time
+from concurrent.futures import ThreadPoolExecutor
+from numpy import frombuffer, full, nan
+from dongle import NoData, CanError
 
 FormatMap = {
     0: {'f': 'x'},
@@ -12,6 +20,23 @@ FormatMap = {
     8: {'f': 'l'},
 }
 
+# Upper bounds (in seconds) of the request latency histogram buckets,
+# an additional last bucket counts all slower requests
+LatencyBuckets = (.01, .02, .05, .1, .2, .5, 1, 2)
+
+
+class CompactResponse(bytes):
+    """ Response of a dynamically defined DID, holding only the bytes
+        that are decoded """
+
+
+class NegativeResponse(NoData):
+    """ ECU answered with a negative response (0x7f) """
+
+    def __init__(self, msg, nrc):
+        NoData.__init__(self, msg)
+        self.nrc = nrc
+
 
 def is_power_of_two(number):
     """ Check of argument has power of two """
@@ -31,13 +56,170 @@ def tq(pos: str) -> int:
     raise ValueError()
 
 
+# Field attributes selecting bits of the unpacked value, see prepare_bits
+BitAttributes = ('bit', 'bits', 'shift', 'mask', 'equals', 'any')
+
+# Statistics of array fields, an array field may select some of them
+# with 'stats' (all by default), see _array_stats
+ArrayStats = ('Min', 'Max', 'Mean', 'Std', 'MinNo', 'MaxNo')
+
+
+def prepare_bits(field):
+    """ Normalize the bit attributes of a field to shift and mask.
+        bit: single flag, bits: number of bits starting at shift,
+        mask: bit mask applied after shifting by shift.
+        The result can be turned into a flag: equals (1 if the value
+        equals it, else 0) or any (1 if any of the bits is set). """
+    if 'bit' in field:
+        field['shift'] = field['bit']
+        field['mask'] = 1
+    elif 'bits' in field:
+        field['shift'] = field.get('shift', 0)
+        field['mask'] = (1 << field['bits']) - 1
+    else:
+        field['shift'] = field.get('shift', 0)
+        field['mask'] = field.get('mask')
+    field['equals'] = field.get('equals')
+    field['any'] = field.get('any', False)
+
+
+def bits_expr(field, value):
+    """ Apply shift and mask of a field to the python expression value """
+    if field['shift']:
+        value = '%s >> %d' % (value, field['shift'])
+    if field['mask'] is not None:
+        value = '%s & 0x%x' % (value, field['mask'])
+    if field['shift'] or field['mask'] is not None:
+        value = '(%s)' % value
+    if field['equals'] is not None:
+        value = 'int(%s == %r)' % (value, field['equals'])
+    elif field['any']:
+        value = 'int(%s != 0)' % value
+    return value
+
+
+def code_strings(code):
+    """ Return all string constants used by a code object, including
+        nested functions """
+    strings = set()
+    for const in code.co_consts:
+        if isinstance(const, str):
+            strings.add(const)
+        elif hasattr(const, 'co_consts'):
+            strings |= code_strings(const)
+    return strings
+
+
+def order_computed(tables):
+    """ Return the computed fields of a field table, ordered so every
+        field is evaluated after the computed fields it reads. The keys a
+        lambda reads are taken from its 'inputs', or else from the field
+        names used in its code. """
+    names = set()
+    computed = {}
+    for entry in tables:
+        for field in entry['fields']:
+            if 'name' not in field:
+                continue
+            names.add(field['name'])
+            if entry.get('computed', False):
+                computed[field['name']] = field
+
+    for name, field in computed.items():
+        if 'inputs' in field:
+            field['inputs'] = tuple(field['inputs'])
+        else:
+            field['inputs'] = tuple(sorted(
+                code_strings(field['lambda'].__code__) & names - {name}))
+        field['last_inputs'] = None
+        field['value'] = None
+
+    ordered = []
+    state = {}
+
+    def visit(name):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('Computed field %s depends on itself' % name)
+        state[name] = 'visiting'
+        for dep in computed[name]['inputs']:
+            if dep in computed:
+                visit(dep)
+        state[name] = 'done'
+        ordered.append(computed[name])
+
+    for name in computed:
+        visit(name)
+
+    return ordered
+
+
+def build_decoder(cmd_data):
+    """ Generate a function specialised for the fields of one command.
+        It unpacks the whole response with a single unpack_from and
+        returns a dict of all scaled values. Scale and offset are
+        inlined as constants, neutral ones are left out. """
+    namespace = {'unpack_from': cmd_data['struct'].unpack_from}
+    values = []
+    for idx, field in enumerate(cmd_data['fields']):
+        fmt_idx = field['fmt_idx']
+        if 'lambda' in field:
+            namespace['l%d' % idx] = field['lambda']
+            value = 'l%d(v[%d:%d])' % (idx, fmt_idx, fmt_idx + field['fmt_len'])
+        else:
+            value = 'v[%d]' % fmt_idx
+
+        value = bits_expr(field, value)
+        if field['scale'] != 1:
+            value += ' * %r' % field['scale']
+        if field['offset'] != 0:
+            value += ' + %r' % field['offset']
+
+        values.append('        %r: %s,' % (field['name'], value))
+
+    source = '\n'.join(['def decode(raw):',
+                        '    v = unpack_from(raw)',
+                        '    return {'] + values + ['    }'])
+    exec(compile(source, '<decoder %s>' % cmd_data['cmd'].hex(), 'exec'), namespace)
+    return namespace['decode']
+
+
 class IsoTpDecoder:
     """ Generic decoder for ISO-TP based cars """
 
-    def __init__(self, dongle, fields):
+    def __init__(self, dongle, fields, config=None, car_type=None):
         self._log = logging.getLogger("EVNotiPi/ISO-TP-Decoder")
         self._dongle = dongle
-        self._fields = fields
+        # preprocess_fields() works in place, car modules share their tables
+        self._fields = deepcopy(fields)
+        self._config = config or {}
+        self._car_type = car_type
+        # Learned layouts are persisted per car type
+        self._layout_cache_file = self._config.get('layout_cache',
+                                                   '/var/cache/evnotipi/isotp_layout.json')
+        self._layout_cache = {}
+
+        # Requests to different ECUs can only be in flight at the same time
+        # if the dongle has independent channels per ECU
+        self._concurrent = (self._config.get('concurrent', False) and
+                            getattr(dongle, 'supports_concurrency', False))
+        self._executor = None
+        # Patterned fields decoded into numpy arrays, by base name
+        self._arrays = {}
+        # Request statistics by (cantx, cmd)
+        self._stats = {}
+        # Send and receive time of the last command, if the dongle knows them
+        self._last_timing = getattr(dongle, 'last_timing', None)
+        # Optional commands failing this many times in a row are skipped
+        # for an exponentially growing number of cycles
+        self._quarantine_after = self._config.get('quarantine_after', 3)
+        self._quarantine_max = self._config.get('quarantine_max', 64)
+        # Skip decoding of byte-identical responses and track changed fields
+        self._delta = self._config.get('delta', False)
+        self._changed = None
+        # Raw responses of commands with a ttl, by (cantx, cmd)
+        self._response_cache = {}
 
         self.preprocess_fields()
 
@@ -59,22 +241,62 @@ class IsoTpDecoder:
             # in the decoder. Checking is slow.
             cmd_data['computed'] = cmd_data.get('computed', False)
             cmd_data['simple'] = cmd_data.get('simple', False)
+
+            # Commands with a refresh interval (in seconds) are only queried
+            # when due, their last values are carried over in between.
+            cmd_data['refresh'] = cmd_data.get('refresh', 0)
+            cmd_data['next_query'] = 0
+            # Responses of commands with a ttl (in seconds, or 'session' for
+            # static values like the VIN) are cached until car off
+            cmd_data['ttl'] = cmd_data.get('ttl', 0)
+            if cmd_data['ttl'] == 'session':
+                cmd_data['ttl'] = float('inf')
+            cmd_data['values'] = {}
+            cmd_data['acquired'] = None
+            # Wall clock time the last response was received
+            cmd_data['sampled'] = None
+            # Last raw response, in delta mode
+            cmd_data['raw'] = None
+            # Consecutive NoData, cycles left to skip and current skip length
+            cmd_data['nodata'] = 0
+            cmd_data['quarantine'] = 0
+            cmd_data['backoff'] = 0
+            cmd_data['arrays'] = []
+            # Response length the learned layout is valid for
+            cmd_data['length'] = None
+            cmd_data['learn'] = None
+            # Byte ranges actually decoded, in response order
+            cmd_data['layout'] = []
+
             absolute_mode = cmd_data.get('absolute', False)
-            if absolute_mode:
-                cmd_data['autopad'] = True
+
+            if not cmd_data['computed']:
+                if 'fc_opts' in cmd_data:
+                    fo = cmd_data['fc_opts']
+                    # bs, stmin, wftmax
+                    cmd_data['fc_opts'] = struct.pack("=BBB", fo[0], fo[1], fo[2])
+                else:
+                    cmd_data['fc_opts'] = None
 
             if cmd_data.get('simple'):
                 # simple mode is for platforms like MEB or Zoe ZE50 which return
                 # one value per command. Padding and width will be auto-set
+                if isinstance(cmd_data['fields'], dict):
+                    cmd_data['fields'] = (cmd_data['fields'],)
                 assert len(cmd_data['fields']) == 1
 
                 field = cmd_data['fields'][0]
                 fmt += str(len(cmd_data['cmd'])) + 'x'
                 field['simple'] = True
+                prepare_bits(field)
                 field['scale'] = field.get('scale', 1)
                 field['offset'] = field.get('offset', 0)
                 field['fmt_idx'] = 0
+                field['fmt_len'] = 1
+                cmd_data['learn'] = 'width'
                 cmd_data['struct'] = struct.Struct(fmt)
+                cmd_data['base_struct'] = cmd_data['struct']
+                cmd_data['decoder'] = build_decoder(cmd_data)
 
             elif not cmd_data['computed']:
                 # Build a new array instead of inserting into the existing one.
@@ -89,18 +311,11 @@ class IsoTpDecoder:
                 else:
                     fields = cmd_data['fields']
 
-                if 'fc_opts' in cmd_data:
-                    fo = cmd_data['fc_opts']
-                    # bs, stmin, wftmax
-                    cmd_data['fc_opts'] = struct.pack("=BBB", fo[0], fo[1], fo[2])
-                else:
-                    cmd_data['fc_opts'] = None
-
                 if 'pos' in fields[0] and not absolute_mode:
                     absolute_mode = True
-                    cmd_data['autopad'] = True
 
                 new_fields = []
+                shared = None
                 for field in fields:
                     self._log.debug(field)
                     # Non power of two types are hard as is. For now those can
@@ -117,7 +332,36 @@ class IsoTpDecoder:
                         field_fmt = str(field.get('padding')) + 'x'
                         self._log.debug("field_fmt(%s)", field_fmt)
                         fmt += field_fmt
+                        shared = None
                     elif not field.get('computed', False):
+                        if absolute_mode:
+                            share = shared is not None and field['pos'] == shared['pos']
+                        else:
+                            # Bit fields without a width use the value of
+                            # the previous field instead of the next bytes
+                            share = 'width' not in field and \
+                                any(attr in field for attr in BitAttributes)
+                            if share and shared is None:
+                                raise ValueError('No previous field to share for %s' %
+                                                 field.get('name'))
+                        if share:
+                            # Another field at the same position, i.e. more
+                            # bits of a status byte. Reuse the unpacked value.
+                            if field.get('width', shared['width']) != shared['width'] or \
+                                    field.get('cnt', 1) > 1 or field.get('array', False):
+                                raise ValueError('Fields sharing a position need the same width')
+                            new_field = field.copy()
+                            new_field['width'] = shared['width']
+                            prepare_bits(new_field)
+                            new_field['scale'] = field.get('scale', 1)
+                            new_field['offset'] = field.get('offset', 0)
+                            new_field['fmt_idx'] = shared['fmt_idx']
+                            new_field['fmt_len'] = shared['fmt_len']
+                            if 'lambda' in shared and 'lambda' not in new_field:
+                                new_field['lambda'] = shared['lambda']
+                            new_fields.append(new_field)
+                            continue
+
                         if absolute_mode:
                             pad = field['pos'] - fmt_last_pos - 1
                             if pad > 0:
@@ -129,6 +373,17 @@ class IsoTpDecoder:
                             
                             fmt_last_pos = field['pos'] + field.get('cnt', 1) * field['width'] - 1
 
+                        if field.get('array', False):
+                            # Patterned field decoded in one go into a numpy
+                            # array. Skip its bytes in the format string.
+                            self._add_array(cmd_data, field, struct.calcsize(fmt))
+                            cmd_data['layout'].append({
+                                'pos': struct.calcsize(fmt),
+                                'size': field['cnt'] * field['width'],
+                                'array': cmd_data['arrays'][-1]})
+                            fmt += str(field['cnt'] * field['width']) + 'x'
+                            continue
+
                         # For patterned fields (i.e. cellVolts%02d) use multiplyer
                         # in format string.
                         field_fmt = str(field.get('cnt', ''))
@@ -138,6 +393,10 @@ class IsoTpDecoder:
                             field_fmt += FormatMap[field['width']]['f'].upper()
 
                         self._log.debug("fmt(%s %s)", fmt, field_fmt)
+                        cmd_data['layout'].append({
+                            'pos': struct.calcsize(fmt),
+                            'size': struct.calcsize('>' + field_fmt),
+                            'fmt': field_fmt})
                         fmt += field_fmt
 
                         if not is_power_of_two(field['width']):
@@ -165,91 +424,818 @@ class IsoTpDecoder:
                             if cnt > 1:
                                 new_field['name'] %= field_idx
 
+                            prepare_bits(new_field)
                             new_field['fmt_idx'] = fmt_idx
                             new_field['fmt_len'] = len(FormatMap[field['width']])
                             fmt_idx += new_field['fmt_len']
 
                             new_fields.append(new_field)
 
+                        shared = new_field if cnt == 1 else None
+
+                # Responses may be longer than the format. unpack_from
+                # ignores trailing bytes, so no padding needs to be learned.
                 self._log.debug("fmt(%s)", fmt)
-                cmd_data['autopad'] = cmd_data.get('autopad', False)
                 cmd_data['struct'] = struct.Struct(fmt)
+                cmd_data['base_struct'] = cmd_data['struct']
                 cmd_data['fields'] = new_fields
+                cmd_data['decoder'] = build_decoder(cmd_data)
+
+        self._link_arrays()
+        self._build_computed()
+        self._load_layouts()
+        self._build_batches()
+        if self._config.get('dynamic_did', False):
+            self._build_dynamic_dids()
+
+    def _build_computed(self):
+        """ Order all computed fields, see order_computed """
+        self._computed = order_computed(self._fields)
+
+    def _compute(self, data, changed=None):
+        """ Evaluate the computed fields whose inputs are all present.
+            Fields keep their last value while their inputs are unchanged.
+            Names of fields that changed are added to changed. """
+        for field in self._computed:
+            try:
+                inputs = tuple([data[key] for key in field['inputs']])
+            except KeyError:
+                if changed is not None and field['last_inputs'] is not None:
+                    changed.add(field['name'])
+                field['last_inputs'] = None
+                continue
+
+            if inputs != field['last_inputs']:
+                value = field['lambda'](data)
+                if changed is not None and (field['last_inputs'] is None or
+                                            value != field['value']):
+                    changed.add(field['name'])
+                field['value'] = value
+                field['last_inputs'] = inputs
+            data[field['name']] = field['value']
+
+    def _build_batches(self):
+        """ Group consecutive simple-mode UDS ReadDataByIdentifier commands
+            for the same ECU into multi-DID requests. A batch is used once
+            the value widths of all its DIDs are learned. """
+        max_dids = self._config.get('max_dids', 8)
+        batches = []
+        batch = None
+        for idx, cmd_data in enumerate(self._fields):
+            cmd = cmd_data.get('cmd')
+            # Commands with a ttl are mostly served from the response cache
+            if not (cmd_data['simple'] and len(cmd) == 3 and cmd[0] == 0x22) or \
+                    cmd_data['ttl']:
+                batch = None
+                continue
+
+            if (batch is None or len(batch['members']) >= max_dids or
+                    batch['cantx'] != cmd_data['cantx'] or
+                    batch['canrx'] != cmd_data['canrx'] or
+                    batch['refresh'] != cmd_data['refresh']):
+                batch = {
+                    'cantx': cmd_data['cantx'],
+                    'canrx': cmd_data['canrx'],
+                    'refresh': cmd_data['refresh'],
+                    'fc_opts': cmd_data['fc_opts'],
+                    'enabled': True,
+                    'members': [],
+                    }
+                batches.append(batch)
+
+            batch['members'].append((idx, cmd_data))
+
+        for batch in batches:
+            if len(batch['members']) < 2:
+                continue
+            batch['cmd'] = b'\x22' + b''.join(m['cmd'][1:] for _, m in batch['members'])
+            for _, cmd_data in batch['members']:
+                cmd_data['batch'] = batch
+
+    def _build_dynamic_dids(self):
+        """ Prepare a dynamically defined DID (UDS 0x2C) per ReadDataByIdentifier
+            command, containing only the byte ranges that are decoded. The
+            compact response is decoded with a format that has all padding
+            removed, so field indices stay the same. """
+        next_did = {}
+        for cmd_data in self._fields:
+            cmd = cmd_data.get('cmd')
+            if (cmd_data['computed'] or cmd_data['simple'] or not cmd_data['layout'] or
+                    len(cmd) != 3 or cmd[0] != 0x22):
+                continue
+
+            did = next_did.get(cmd_data['cantx'], self._config.get('dynamic_did_base', 0xf300))
+            next_did[cmd_data['cantx']] = did + 1
+            did = did.to_bytes(2, 'big')
+
+            fmt = '>3x'
+            ranges = []
+            arrays = []
+            for item in cmd_data['layout']:
+                if item.get('array'):
+                    spec = dict(item['array'])
+                    spec['pos'] = struct.calcsize(fmt)
+                    arrays.append(spec)
+                    fmt += '%dx' % item['size']
+                else:
+                    fmt += item['fmt']
+
+                if ranges and ranges[-1][0] + ranges[-1][1] == item['pos'] and \
+                        ranges[-1][1] + item['size'] <= 0xff:
+                    ranges[-1][1] += item['size']
+                else:
+                    ranges.append([item['pos'], item['size']])
+
+            # defineByIdentifier: source DID, position (1 based, after the
+            # DID echo) and size of every range
+            define = b'\x2c\x01' + did + b''.join(
+                cmd[1:] + bytes((pos - len(cmd) + 1, size)) for pos, size in ranges)
+
+            ecu = {'cantx': cmd_data['cantx'], 'canrx': cmd_data['canrx'],
+                   'fc_opts': cmd_data['fc_opts']}
+            layout = dict(ecu, cmd=b'\x22' + did, struct=struct.Struct(fmt),
+                          fields=cmd_data['fields'], arrays=arrays,
+                          define=dict(ecu, cmd=define),
+                          clear=dict(ecu, cmd=b'\x2c\x03' + did),
+                          state='new', failures=0)
+            layout['decoder'] = build_decoder(layout)
+            cmd_data['ddid'] = layout
+
+    def _add_array(self, cmd_data, field, byte_pos):
+        """ Register a patterned field that is decoded into a numpy array.
+            All patterned fields with the same name share one array, even
+            across commands. """
+        if field.get('cnt', 1) < 2 or 'lambda' in field or \
+                any(attr in field for attr in BitAttributes):
+            raise ValueError('Array fields need to be patterned and must not have a lambda or bits')
+        if not set(field.get('stats', ())) <= set(ArrayStats):
+            raise ValueError('Unknown array statistics %s' % (field['stats'],))
+
+        pattern = field['name']
+        name = pattern.split('%')[0]
+        start = field.get('idx', 0)
+        cnt = field['cnt']
+
+        array = self._arrays.get(name)
+        wanted = field.get('stats', ArrayStats)
+        if array is None:
+            first, size = start, cnt
+        else:
+            first = min(array['first'], start)
+            size = max(array['first'] + len(array['values']), start + cnt) - first
+            wanted = tuple(stat for stat in ArrayStats
+                           if stat in wanted or stat in array['wanted'])
+
+        if array is None or first != array['first'] or size != len(array['values']):
+            values = full(size, nan)
+            if array is not None:
+                shift = array['first'] - first
+                values[shift:shift + len(array['values'])] = array['values']
+            array = {'pattern': pattern, 'first': first, 'values': values}
+            self._arrays[name] = array
+        array['wanted'] = wanted
+
+        cmd_data['arrays'].append({
+            'name': name,
+            'start': start,
+            'cnt': cnt,
+            'pos': byte_pos,
+            'dtype': '>%s%d' % ('i' if field.get('signed', False) else 'u', field['width']),
+            'scale': field.get('scale', 1),
+            'offset': field.get('offset', 0),
+            })
+
+    def _link_arrays(self):
+        """ Point the array specs of all commands to their (final) target slice """
+        for array in self._arrays.values():
+            # Statistics are only calculated again after the array changed
+            array['dirty'] = True
+            array['stats'] = {}
+        for cmd_data in self._fields:
+            for spec in cmd_data['arrays']:
+                array = self._arrays[spec['name']]
+                begin = spec['start'] - array['first']
+                spec['target'] = array['values'][begin:begin + spec['cnt']]
+                spec['array'] = array
+
+    def _query(self, cmd_data, can_tries):
+        """ Send a command to the CAN bus and return the raw response.
+            NoData is retried can_tries times. """
+        stats = self._stats.get((cmd_data['cantx'], cmd_data['cmd']))
+        if stats is None:
+            stats = self._stats.setdefault((cmd_data['cantx'], cmd_data['cmd']), {
+                'requests': 0, 'success': 0, 'retries': 0, 'nodata': 0,
+                'negative': 0, 'canerror': 0, 'last_latency': None,
+                'bus_latency': None,
+                'latency': [0] * (len(LatencyBuckets) + 1),
+                })
+        stats['requests'] += 1
+
+        can_try = 0
+        start = monotonic()
+        try:
+            while True:
+                can_try += 1
+                try:
+                    raw = self._dongle.send_command_ex(cmd_data['cmd'],
+                                                       canrx=cmd_data['canrx'],
+                                                       cantx=cmd_data['cantx'],
+                                                       fc_opts=cmd_data['fc_opts'])
+                    break
+                except NoData:
+                    if can_try > can_tries:
+                        stats['nodata'] += 1
+                        raise
+        except CanError:
+            stats['canerror'] += 1
+            raise
+        finally:
+            latency = monotonic() - start
+            stats['last_latency'] = latency
+            stats['latency'][bisect_left(LatencyBuckets, latency)] += 1
+            stats['retries'] += can_try - 1
+
+        timing = self._last_timing() if self._last_timing is not None else None
+        if timing is not None:
+            # Latency of the successful try, without scheduling delays
+            cmd_data['sampled'] = timing[1]
+            stats['bus_latency'] = timing[1] - timing[0]
+        else:
+            cmd_data['sampled'] = time()
+
+        if raw[0] == 0x7f:
+            stats['negative'] += 1
+            nrc = raw[2] if len(raw) > 2 else 0
+            raise NegativeResponse("Negative response cmd(%s) nrc(0x%02x)" %
+                                   (cmd_data['cmd'].hex(), nrc), nrc)
+
+        stats['success'] += 1
+        return raw
+
+    def _fetch(self, idx, cmd_data, can_tries, responses):
+        """ Query a command and store its raw response, or the exception
+            raised, in responses. Multi-DID batches fill in all members.
+            Responses of commands with a ttl are served from the cache. """
+        if not cmd_data['ttl']:
+            self._fetch_ecu(idx, cmd_data, can_tries, responses)
+            return
+
+        key = (cmd_data['cantx'], cmd_data['cmd'])
+        cached = self._response_cache.get(key)
+        if cached is not None and cached[0] > monotonic():
+            responses[idx] = cached[1]
+            return
+
+        self._fetch_ecu(idx, cmd_data, can_tries, responses)
+        if not isinstance(responses[idx], Exception):
+            self._response_cache[key] = (monotonic() + cmd_data['ttl'], responses[idx])
+
+    def close(self):
+        """ Stop the worker threads of concurrent queries """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def invalidate_cache(self):
+        """ Drop all cached responses and carried over values and query all
+            commands in the next cycle, e.g. after the car was off """
+        self._response_cache.clear()
+        for cmd_data in self._fields:
+            cmd_data['next_query'] = 0
+            cmd_data['values'] = {}
+            cmd_data['acquired'] = None
+            cmd_data['sampled'] = None
+            cmd_data['raw'] = None
+        for array in self._arrays.values():
+            array['values'][:] = nan
+            array['dirty'] = True
+
+    def _fetch_ecu(self, idx, cmd_data, can_tries, responses):
+        """ Query a command from the ECU, see _fetch """
+        ddid = cmd_data.get('ddid')
+        if ddid is not None and ddid['state'] != 'unsupported':
+            self._fetch_ddid(idx, ddid, can_tries, responses)
+            if idx in responses:
+                if not isinstance(responses[idx], Exception):
+                    cmd_data['sampled'] = ddid['sampled']
+                return
+
+        batch = cmd_data.get('batch')
+        if (batch is not None and batch['enabled'] and
+                all(m['length'] is not None for _, m in batch['members'])):
+            self._fetch_batch(batch, can_tries, responses)
+            if idx in responses:
+                return
+
+        try:
+            responses[idx] = self._query(cmd_data, can_tries)
+        except (NoData, CanError) as err:
+            responses[idx] = err
+
+    def _define_ddid(self, ddid, can_tries):
+        """ (Re-)register a dynamically defined DID with the ECU.
+            Returns True on success. """
+        # Defining appends to an existing definition, so clear it first
+        try:
+            self._query(ddid['clear'], 0)
+        except NoData:
+            pass
+
+        try:
+            self._query(ddid['define'], can_tries)
+        except NegativeResponse as err:
+            self._log.info("canid(0x%x) dynamic DID not supported: %s", ddid['cantx'], err)
+            ddid['state'] = 'unsupported'
+            return False
+        except NoData:
+            ddid['failures'] += 1
+            if ddid['failures'] >= 3:
+                ddid['state'] = 'unsupported'
+            return False
+
+        self._log.info("canid(0x%x) defined dynamic DID %s",
+                       ddid['cantx'], ddid['cmd'][1:].hex())
+        ddid['state'] = 'defined'
+        return True
+
+    def _fetch_ddid(self, idx, ddid, can_tries, responses):
+        """ Read a command through its dynamically defined DID. On failure
+            nothing is stored and the original command is used instead. """
+        try:
+            if ddid['state'] == 'new' and not self._define_ddid(ddid, can_tries):
+                return
+            raw = self._query(ddid, can_tries)
+        except NegativeResponse as err:
+            # Definitions get lost on ECU resets or session changes
+            self._log.info("canid(0x%x) dynamic DID lost: %s", ddid['cantx'], err)
+            raw = None
+        except (NoData, CanError) as err:
+            responses[idx] = err
+            return
+
+        if raw is not None and len(raw) == ddid['struct'].size and \
+                raw[1:3] == ddid['cmd'][1:]:
+            ddid['failures'] = 0
+            responses[idx] = CompactResponse(raw)
+            return
+
+        ddid['failures'] += 1
+        ddid['state'] = 'new' if ddid['failures'] < 3 else 'unsupported'
+
+    def _fetch_batch(self, batch, can_tries, responses):
+        """ Query all DIDs of a batch with one request and split the
+            response. Falls back to single requests if the ECU rejects
+            multi-DID requests. """
+        members = batch['members']
+        try:
+            raw = self._query(batch, can_tries)
+        except NegativeResponse as err:
+            raw = None
+            self._log.info("canid(0x%x) rejected multi-DID request: %s", batch['cantx'], err)
+        except NoData:
+            # Some ECUs silently ignore multi-DID requests. Ask every DID on
+            # its own, if any of them answers stop batching.
+            for idx, cmd_data in members:
+                try:
+                    responses[idx] = self._query(cmd_data, can_tries)
+                except (NoData, CanError) as err:
+                    responses[idx] = err
+            if not all(isinstance(responses[idx], NoData) for idx, _ in members):
+                self._log.info("canid(0x%x) ignored multi-DID request, disabled",
+                               batch['cantx'])
+                batch['enabled'] = False
+            return
+        except CanError as err:
+            for idx, _ in members:
+                responses[idx] = err
+            return
+
+        if raw is not None:
+            split = self._split_batch(batch, raw)
+            if split is not None:
+                responses.update(split)
+                for _, cmd_data in members:
+                    cmd_data['sampled'] = batch['sampled']
+                return
+            self._log.info("canid(0x%x) unexpected multi-DID response %s",
+                           batch['cantx'], raw.hex())
+
+        batch['enabled'] = False
+
+    @staticmethod
+    def _split_batch(batch, raw):
+        """ Split a multi-DID response into single responses per DID.
+            Returns None if it does not match the learned layout. """
+        if raw[0] != 0x62:
+            return None
+
+        responses = {}
+        pos = 1
+        for idx, cmd_data in batch['members']:
+            cmd = cmd_data['cmd']
+            end = pos + cmd_data['struct'].size - 1
+            if raw[pos:pos+2] != cmd[1:] or end > len(raw):
+                return None
+            responses[idx] = b'\x62' + bytes(raw[pos:end])
+            pos = end
+
+        if pos != len(raw):
+            return None
+
+        return responses
+
+    def _query_ecu(self, queue, can_tries):
+        """ Serially query a list of (index, cmd_data) for the same ECU.
+            Returns a dict of index => raw response or exception. """
+        responses = {}
+        for idx, cmd_data in queue:
+            if idx not in responses:
+                self._fetch(idx, cmd_data, can_tries, responses)
+            err = responses[idx]
+            if isinstance(err, CanError) or \
+                    (isinstance(err, NoData) and not cmd_data.get('optional', False)):
+                # The whole cycle will be aborted anyway
+                break
+        return responses
+
+    def _query_concurrent(self, can_tries, now):
+        """ Query all due commands with one worker per ECU. Commands for the
+            same ECU stay serialized. Returns a dict of index => raw response
+            or exception. """
+        queues = {}
+        for idx, cmd_data in enumerate(self._fields):
+            if (not cmd_data['computed'] and cmd_data['next_query'] <= now and
+                    not cmd_data['quarantine']):
+                queues.setdefault(cmd_data['cantx'], []).append((idx, cmd_data))
+
+        if self._executor is None:
+            ecus = {c['cantx'] for c in self._fields if not c['computed']}
+            self._executor = ThreadPoolExecutor(max_workers=max(1, len(ecus)),
+                                                thread_name_prefix="EVNotiPi/ISO-TP")
+
+        futures = [self._executor.submit(self._query_ecu, queue, can_tries)
+                   for queue in queues.values()]
+
+        responses = {}
+        for future in futures:
+            responses.update(future.result())
+
+        return responses
+
+    def _quarantine(self, cmd_data):
+        """ Account a NoData of an optional command. Skip it after too many
+            in a row, doubling the number of skipped cycles every time it
+            fails again. """
+        cmd_data['nodata'] += 1
+        if cmd_data['nodata'] < self._quarantine_after:
+            return
+
+        cmd_data['backoff'] = min(max(1, cmd_data['backoff'] * 2), self._quarantine_max)
+        cmd_data['quarantine'] = cmd_data['backoff']
+        self._log.info("canid(0x%x) cmd(%s) no data %d times, skipping %d cycles",
+                       cmd_data['cantx'], cmd_data['cmd'].hex(),
+                       cmd_data['nodata'], cmd_data['backoff'])
+
+    def _apply_layout(self, cmd_data, size, length):
+        """ Set the learned value width of a simple mode command,
+            expected to produce responses of length bytes. """
+        field = cmd_data['fields'][0]
+        fmt = cmd_data['base_struct'].format
+        if size not in FormatMap or size == 0:
+            raise CanError("Unsupported value width %d cmd(%s)" %
+                           (size, cmd_data['cmd'].hex()))
+        if field.get('signed', False):
+            fmt += FormatMap[size]['f'].lower()
+        else:
+            fmt += FormatMap[size]['f'].upper()
+        if is_power_of_two(size):
+            field.pop('lambda', None)
+            field['fmt_len'] = 1
+        else:
+            field['lambda'] = FormatMap[size]['l']
+            field['fmt_len'] = len(FormatMap[size])
+
+        cmd_data['struct'] = struct.Struct(fmt)
+        cmd_data['decoder'] = build_decoder(cmd_data)
+        cmd_data['length'] = length
+
+    def _learn_layout(self, cmd_data, raw):
+        """ Adapt the format of a command to a response of unexpected length,
+            i.e. learn the value width on first encounter """
+        size = len(raw) - cmd_data['base_struct'].size
+        relearn = cmd_data['length'] is not None
+        self._apply_layout(cmd_data, size, len(raw))
+        self._log.info("canid(0x%x) cmd(%s) len(%i) %s(%i)%s",
+                       cmd_data['cantx'], cmd_data['cmd'].hex(), len(raw),
+                       cmd_data['learn'], size, ' relearned' if relearn else '')
+        self._store_layout(cmd_data, size)
+
+    @staticmethod
+    def _layout_key(cmd_data):
+        """ Key of a command in the layout cache """
+        return '%x:%s' % (cmd_data['cantx'], cmd_data['cmd'].hex())
+
+    def _load_layouts(self):
+        """ Apply layouts learned during earlier runs """
+        if not self._car_type or not self._layout_cache_file:
+            return
+
+        try:
+            with open(self._layout_cache_file, encoding='utf-8') as cache_file:
+                self._layout_cache = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            self._log.warning("Ignoring layout cache %s: %s", self._layout_cache_file, err)
+            return
+
+        layouts = self._layout_cache.get(self._car_type, {})
+        for cmd_data in self._fields:
+            if not cmd_data['learn']:
+                continue
+
+            layout = layouts.get(self._layout_key(cmd_data))
+            if layout is None:
+                continue
+
+            try:
+                self._apply_layout(cmd_data, layout['size'], layout['len'])
+                valid = (cmd_data['struct'].format == layout['fmt'] and
+                         cmd_data['struct'].size <= layout['len'])
+            except (CanError, KeyError, TypeError, struct.error):
+                valid = False
+
+            if not valid:
+                # Field definitions changed since, learn again
+                self._log.info("Discarding cached layout of %s", self._layout_key(cmd_data))
+                cmd_data['struct'] = cmd_data['base_struct']
+                cmd_data['decoder'] = build_decoder(cmd_data)
+                cmd_data['length'] = None
+
+    def _store_layout(self, cmd_data, size):
+        """ Persist a learned layout """
+        if not self._car_type or not self._layout_cache_file:
+            return
+
+        self._layout_cache.setdefault(self._car_type, {})[self._layout_key(cmd_data)] = {
+            'fmt': cmd_data['struct'].format,
+            'len': cmd_data['length'],
+            'size': size,
+            }
+
+        tmp_file = self._layout_cache_file + '.tmp'
+        try:
+            cache_dir = os.path.dirname(self._layout_cache_file)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            with open(tmp_file, 'w', encoding='utf-8') as cache_file:
+                json.dump(self._layout_cache, cache_file, indent=1)
+            os.replace(tmp_file, self._layout_cache_file)
+        except OSError as err:
+            self._log.warning("Could not write layout cache %s: %s", self._layout_cache_file, err)
+
+    def _decode(self, cmd_data, raw):
+        """ Decode the raw response of a command. Returns a dict of values. """
+        if raw.__class__ is CompactResponse:
+            # Layout of dynamically defined DIDs is known in advance
+            layout = cmd_data['ddid']
+        else:
+            layout = cmd_data
+            if cmd_data['learn'] and len(raw) != cmd_data['length']:
+                self._learn_layout(cmd_data, raw)
+
+        if layout['arrays'] and len(raw) < layout['struct'].size:
+            # Truncated multi frame response. Handled like a missing one,
+            # i.e. the arrays are set to NaN instead of being filled partly.
+            self._log.warning("Truncated response cmd(%s) len(%d) < %d",
+                              cmd_data['cmd'].hex(), len(raw), layout['struct'].size)
+            raise NoData('Truncated response')
+
+        values = layout['decoder'](raw)
+
+        for spec in layout['arrays']:
+            # Slice assignment writes into the shared array
+            spec['target'][:] = frombuffer(raw, spec['dtype'], spec['cnt'], spec['pos']) * \
+                spec['scale'] + spec['offset']
+            spec['array']['dirty'] = True
+
+        return values
+
+    @staticmethod
+    def _decode_fields(cmd_data, raw):
+        """ Decode raw by interpreting the field definitions one by one.
+            Equivalent to the generated decoder, kept for reference and
+            benchmarking. """
+        raw_fields = cmd_data['struct'].unpack_from(raw)
+
+        data = {}
+        for field in cmd_data['fields']:
+            name = field['name']
+            fmt_idx = field['fmt_idx']
+            fmt_len = field['fmt_len']
+
+            if 'lambda' in field:
+                value = field['lambda'](raw_fields[fmt_idx:fmt_idx+fmt_len])
+            else:
+                value = raw_fields[fmt_idx]
+
+            if field['shift']:
+                value >>= field['shift']
+            if field['mask'] is not None:
+                value &= field['mask']
+            if field['equals'] is not None:
+                value = int(value == field['equals'])
+            elif field['any']:
+                value = int(value != 0)
+
+            data[name] = value * field['scale'] + field['offset']
+
+        return data
+
+    def _array_stats(self, data, changed=None):
+        """ Add the requested statistics of all arrays to data, ignoring
+            missing (NaN) cells. Cell numbers use the same numbering as the
+            patterned field names. Arrays are passed on in data['_arrays']
+            as (pattern, first, values). """
+        arrays = {}
+        for name, array in self._arrays.items():
+            if array['dirty']:
+                values = array['values']
+                array['copy'] = values.copy()
+                stats = {}
+                wanted = array['wanted']
+                # Cell counts are small, builtins on a list beat a numpy
+                # reduction per statistic
+                cells = values.tolist()
+                valid = [value for value in cells if value == value]
+                if valid and wanted:
+                    low, high = min(valid), max(valid)
+                    mean = sum(valid) / len(valid)
+                    stats = {name + stat: value for stat, value in
+                             (('Min', low), ('Max', high), ('Mean', mean))
+                             if stat in wanted}
+                    if 'Std' in wanted:
+                        stats[name + 'Std'] = sqrt(sum((value - mean) ** 2 for value in valid) /
+                                                   len(valid))
+                    if 'MinNo' in wanted:
+                        stats[name + 'MinNo'] = cells.index(low) + array['first']
+                    if 'MaxNo' in wanted:
+                        stats[name + 'MaxNo'] = cells.index(high) + array['first']
+                if changed is not None:
+                    changed.update(key for key in stats.keys() | array['stats'].keys()
+                                   if stats.get(key) != array['stats'].get(key))
+                array['stats'] = stats
+                array['dirty'] = False
+
+            arrays[name] = (array['pattern'], array['first'], array['copy'])
+            data.update(array['stats'])
+
+        data['_arrays'] = arrays
+
+    def get_stats(self):
+        """ Return a snapshot of the request statistics, by cantx:cmd (hex).
+            latency is a histogram with the bucket bounds of LatencyBuckets
+            plus one bucket for slower requests. Retried requests count as
+            one request, their latency includes all tries. bus_latency is
+            the time from sending to the response of the last successful
+            try, from the timestamps of the dongle (None if it has none). """
+        snapshot = {}
+        for (cantx, cmd), stats in list(self._stats.items()):
+            stats = dict(stats)
+            stats['latency'] = list(stats['latency'])
+            snapshot['%x:%s' % (cantx, cmd.hex())] = stats
+        for cmd_data in self._fields:
+            if not cmd_data['computed'] and self._layout_key(cmd_data) in snapshot:
+                snapshot[self._layout_key(cmd_data)]['quarantine'] = cmd_data['quarantine']
+        return snapshot
+
+    def _stats_fields(self, data):
+        """ Add the request statistics to data, as flat fields per command """
+        for key, stats in self.get_stats().items():
+            key = key.replace(':', '_')
+            data.update({
+                'isotpRequests_' + key: stats['requests'],
+                'isotpErrors_' + key: stats['requests'] - stats['success'],
+                'isotpRetries_' + key: stats['retries'],
+                'isotpLatency_' + key: stats['last_latency'],
+                'isotpBusLatency_' + key: stats['bus_latency'],
+                })
+
+    def get_changed_fields(self):
+        """ Return the names of the fields that changed during the last
+            get_data call, including fields that disappeared. None if delta
+            mode is off. """
+        return self._changed
+
+    def get_field_ages(self):
+        """ Return the age in seconds of the last decoded value of every field """
+        now = monotonic()
+        ages = {}
+        for cmd_data in self._fields:
+            if not cmd_data['computed'] and cmd_data['acquired'] is not None:
+                age = now - cmd_data['acquired']
+                for name in cmd_data['values']:
+                    ages[name] = age
+        return ages
+
+    def get_field_times(self):
+        """ Return the wall clock time the response of the last decoded
+            value of every field was received. With SocketCAN this is the
+            kernel timestamp of the response. """
+        times = {}
+        for cmd_data in self._fields:
+            if not cmd_data['computed'] and cmd_data['sampled'] is not None:
+                for name in cmd_data['values']:
+                    times[name] = cmd_data['sampled']
+        return times
 
     def get_data(self, can_tries=1):
         """ Takes a structure which describes adresses,
             commands and how to decode the return """
         data = {}
-        for cmd_data in self._fields:
+        changed = set() if self._delta else None
+        now = monotonic()
+        responses = self._query_concurrent(can_tries, now) if self._concurrent else {}
+
+        for idx, cmd_data in enumerate(self._fields):
+            if cmd_data['computed']:
+                # Fields of computed "commands" are filled in dependency
+                # order once all commands are decoded
+                continue
+
+            raw = None
             try:
-                if cmd_data['computed']:
-                    # Fields of computed "commands" are filled by executing
-                    # the fields lambda with the data dict as argument
-                    for field in cmd_data['fields']:
-                        name = field['name']
-                        func = field['lambda']
-                        data[name] = func(data)
-                else:
-                    # Send a command to the CAN bus and parse the resulting
-                    # bytearray using unpack. The format for unpack was generated
-                    # in the preprocessor. Extracted values are scaled, shifted
-                    # and a lambda function is executed if provided
-                    can_try = 0
-                    while True:
-                        can_try += 1
-                        try:
-                            raw = self._dongle.send_command_ex(cmd_data['cmd'],
-                                                               canrx=cmd_data['canrx'],
-                                                               cantx=cmd_data['cantx'],
-                                                               fc_opts=cmd_data['fc_opts'])
-                            break
-                        except NoData:
-                            if can_try > can_tries:
-                                raise
-                    # Learn how much to pad a block on first encounter if autopadding is active
-                    if cmd_data['autopad']:
-                        pad = len(raw) - cmd_data['struct'].size
-                        if pad > 0:
-                            fmt = cmd_data['struct'].format
-                            fmt += str(pad) + 'x'
-                            cmd_data['struct'] = struct.Struct(fmt)
-                            self._log.info("canid(0x%x) cmd(%s) len(%i) pad(%i)",
-                                           cmd_data['cantx'], cmd_data['cmd'].hex(),
-                                           len(raw), pad)
-                        cmd_data['autopad'] = False
-
-                    elif cmd_data['simple']:
-                        width = len(raw) - cmd_data['struct'].size
-                        assert 0 < width <= 8
-                        fmt = cmd_data['struct'].format
-                        if cmd_data['fields'][0].get('signed', False):
-                            fmt += FormatMap[width]['f'].lower()
-                        else:
-                            fmt += FormatMap[width]['f'].upper()
-                        cmd_data['struct'] = struct.Struct(fmt)
-                        cmd_data['simple'] = False
+                # Send a command to the CAN bus and parse the resulting
+                # bytearray using unpack. The format for unpack was generated
+                # in the preprocessor. Extracted values are scaled, shifted
+                # and a lambda function is executed if provided
+                if cmd_data['next_query'] > now:
+                    # Not due yet, reuse the values of the last query
+                    data.update(cmd_data['values'])
+                    continue
 
-                    raw_fields = cmd_data['struct'].unpack(raw)
+                if cmd_data['quarantine']:
+                    cmd_data['quarantine'] -= 1
+                    continue
 
-                    for field in cmd_data['fields']:
-                        name = field['name']
-                        fmt_idx = field['fmt_idx']
-                        fmt_len = field['fmt_len']
+                if idx not in responses:
+                    self._fetch(idx, cmd_data, can_tries, responses)
+                raw = responses[idx]
+                if isinstance(raw, Exception):
+                    raise raw
 
-                        if 'lambda' in field:
-                            value = field['lambda'](raw_fields[fmt_idx:fmt_idx+fmt_len])
-                        else:
-                            value = raw_fields[fmt_idx]
+                if changed is None:
+                    values = self._decode(cmd_data, raw)
+                elif raw != cmd_data['raw']:
+                    values = self._decode(cmd_data, raw)
+                    cmd_data['raw'] = raw
+                    old = cmd_data['values']
+                    changed.update(name for name, value in values.items()
+                                   if name not in old or old[name] != value)
+                    changed.update(old.keys() - values.keys())
+                else:
+                    # Byte-identical to the last response, nothing to decode
+                    values = cmd_data['values']
+
+                cmd_data['values'] = values
+                cmd_data['acquired'] = now
+                cmd_data['next_query'] = now + cmd_data['refresh']
+                data.update(values)
 
-                        data[name] = value * field['scale'] + field['offset']
+                if cmd_data['backoff']:
+                    self._log.info("canid(0x%x) cmd(%s) answering again",
+                                   cmd_data['cantx'], cmd_data['cmd'].hex())
+                    cmd_data['backoff'] = 0
+                cmd_data['nodata'] = 0
 
             except NoData:
+                if changed is not None:
+                    changed.update(cmd_data['values'])
+                cmd_data['values'] = {}
+                cmd_data['acquired'] = None
+                cmd_data['sampled'] = None
+                cmd_data['raw'] = None
+                for spec in cmd_data['arrays']:
+                    spec['target'][:] = nan
+                    spec['array']['dirty'] = True
                 if not cmd_data.get('optional', False):
                     raise
+                self._quarantine(cmd_data)
             except struct.error as err:
                 self._log.error("err(%s) cmd(%s) fmt(%s):%d raw(%s):%d", err, cmd_data['cmd'].hex(),
                                 cmd_data['struct'].format, cmd_data['struct'].size,
                                 raw.hex(), len(raw))
                 raise
 
+        # Fields of computed "commands" are filled by executing the fields
+        # lambda with the data dict as argument
+        self._compute(data, changed)
+
+        if self._arrays:
+            self._array_stats(data, changed)
+        self._changed = changed
+
+        if self._config.get('stats', False):
+            self._stats_fields(data)
+
         return data
@@ -32,25 +32,26 @@ Fields = (
          {'name': 'cumulativeEnergyDischarged', 'width': 4, 'scale': .1},
          {'name': 'operatingTime', 'width': 4},  # seconds
          {'name': 'charging_bits2', 'width': 1},
+         {'name': 'charging', 'mask': 0xc, 'equals': 0x8},
          {'padding': 8},
      )
      },
-    {'cmd': b220102, 'canrx': 0x7ec, 'cantx': 0x7e4,
+    {'cmd': b220102, 'canrx': 0x7ec, 'cantx': 0x7e4, 'refresh': 30,
      'fields': (
          {'padding': 7},
-         {'name': 'cellVoltage%02d', 'idx': 1, 'cnt': 32, 'width': 1, 'scale': .02},
+         {'name': 'cellVoltage%02d', 'idx': 1, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
      )
      },
-    {'cmd': b220103, 'canrx': 0x7ec, 'cantx': 0x7e4,
+    {'cmd': b220103, 'canrx': 0x7ec, 'cantx': 0x7e4, 'refresh': 30,
      'fields': (
          {'padding': 7},
-         {'name': 'cellVoltage%02d', 'idx': 33, 'cnt': 32, 'width': 1, 'scale': .02},
+         {'name': 'cellVoltage%02d', 'idx': 33, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
      )
      },
-    {'cmd': b220104, 'canrx': 0x7ec, 'cantx': 0x7e4,
+    {'cmd': b220104, 'canrx': 0x7ec, 'cantx': 0x7e4, 'refresh': 30,
      'fields': (
          {'padding': 7},
-         {'name': 'cellVoltage%02d', 'idx': 65, 'cnt': 32, 'width': 1, 'scale': .02},
+         {'name': 'cellVoltage%02d', 'idx': 65, 'cnt': 32, 'width': 1, 'scale': .02, 'array': True},
      )
      },
     {'cmd': b220105, 'canrx': 0x7ec, 'cantx': 0x7e4,
@@ -62,7 +63,7 @@ Fields = (
          {'padding': 11},
      )
      },
-    {'cmd': b22b002, 'canrx': 0x7ce, 'cantx': 0x7c6, 'optional': True,
+    {'cmd': b22b002, 'canrx': 0x7ce, 'cantx': 0x7c6, 'optional': True, 'refresh': 60,
      'fields': (
          {'padding': 9},
          {'name': 'odo', 'width': 3},
@@ -81,8 +82,6 @@ Fields = (
      'fields': (
          {'name': 'dcBatteryPower',
           'lambda': lambda d: d['dcBatteryCurrent'] * d['dcBatteryVoltage'] / 1000.0},
-         {'name': 'charging',
-          'lambda': lambda d: int(d['charging_bits2'] & 0xc == 0x8)},
          {'name': 'normalChargePort',
           'lambda': lambda d: int((d['charging_bits2'] & 0x80) != 0 and d['charging_bits1'] == 3)},
          {'name': 'rapidChargePort',
@@ -98,7 +97,8 @@ class KonaEv(Car):
     def __init__(self, config, dongle, watchdog, gps):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_11_500')
-        self._isotp = IsoTpDecoder(self._dongle, Fields)
+        self._isotp = IsoTpDecoder(self._dongle, Fields, config.get('isotp'),
+                                  car_type=config.get('type'))
 
     def read_dongle(self, data):
         """ Read and parse data from dongle """
@@ -65,13 +65,13 @@ Fields = [
          {'name': 'dcBatteryCurrent', 'width': 2, 'offset': -1000, 'scale': .025},
      )
      },
-    {'cmd': CMD_ODO, 'canrx': IPK_RX, 'cantx': IPK_TX,
+    {'cmd': CMD_ODO, 'canrx': IPK_RX, 'cantx': IPK_TX, 'refresh': 60,
      'fields': (
          {'padding': 3},
          {'name': 'odo', 'width': 3},
      )
      },
-    {'cmd': CMD_SOH, 'canrx': BMS_RX, 'cantx': BMS_TX,
+    {'cmd': CMD_SOH, 'canrx': BMS_RX, 'cantx': BMS_TX, 'refresh': 300,
      'fields': (
          {'padding': 3},
          {'name': 'soh', 'width': 2, 'scale': .01},
@@ -100,7 +100,8 @@ class MgZsEv(Car):
     def __init__(self, config, dongle, watchdog, gps):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_11_500')
-        self._isotp = IsoTpDecoder(self._dongle, Fields)
+        self._isotp = IsoTpDecoder(self._dongle, Fields, config.get('isotp'),
+                                  car_type=config.get('type'))
 
     def read_dongle(self, data):
         """ Read and parse data from dongle """
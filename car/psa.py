@@ -28,7 +28,7 @@ Fields = [
             'fields': ({'name': 'batteryMaxTemperature', 'signed': True})},
         {'cmd': '22d410', 'canrx': BMS_RX, 'cantx': BMS_TX, 'simple': True,
             'fields': ({'name': 'SOC_DISPLAY', 'scale': 1/512})},
-        {'cmd': '22d860', 'canrx': BMS_RX, 'cantx': BMS_TX, 'simple': True,
+        {'cmd': '22d860', 'canrx': BMS_RX, 'cantx': BMS_TX, 'simple': True, 'ttl': 'session',
             'fields': ({'name': 'soh', 'scale': 1/16})},
         {'cmd': '22d434', 'canrx': XXX_RX, 'cantx': XXX_TX, 'simple': True,
             'fields': ({'name': 'externalTemperature', 'signed': True})},
@@ -53,7 +53,8 @@ class Psa(Car):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_29_500')
 
-        self._isotp = IsoTpDecoder(self._dongle, Fields)
+        self._isotp = IsoTpDecoder(self._dongle, Fields, config.get('isotp'),
+                                  car_type=config.get('type'))
 
     def read_dongle(self, data):
         """ Read and parse data from dongle """
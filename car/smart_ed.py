@@ -1,11 +1,11 @@
 """ Module for the Smart ED """
 
 from time import monotonic
-from threading import Thread, Lock
-import logging
-from .car import Car, ifbu, ifbs
+from threading import Thread
+from .car import Car
+from .broadcast_decoder import BroadcastDecoder
 from .isotp_decoder import IsoTpDecoder
-from dongle import NoData
+from dongle import NoData, CanError
 
 BattHWrev = bytes.fromhex('22f150')
 BattSWrev = bytes.fromhex('22f151')
@@ -50,14 +50,40 @@ ChargerAmps = bytes.fromhex('220225')
 ChargerSelCurrent = bytes.fromhex('22022A')
 ChargerTemperatures = bytes.fromhex('220223')
 
-RawFilters = (
-        {'id': 0x518, 'mask': 0x7ff},   # SOC_DISPLAY
-        {'id': 0x2d5, 'mask': 0x7ff},   # SOC_BMS
-        {'id': 0x508, 'mask': 0x7ff},   # Current
-        {'id': 0x448, 'mask': 0x7ff},   # Voltage
-        {'id': 0x3d5, 'mask': 0x7ff},   # Aux Voltage
-        {'id': 0x412, 'mask': 0x7ff},   # ODO
-        )
+Frames = (
+    {'can_id': 0x518,
+     'fields': (
+         {'pos': 7, 'name': 'SOC_DISPLAY', 'scale': .5},
+         )},
+    {'can_id': 0x2d5,
+     'fields': (
+         {'pos': 4, 'width': 2, 'name': 'SOC_BMS', 'mask': 0x3ff},
+         )},
+    # Current and voltage are sent far more often than they are polled
+    {'can_id': 0x508, 'interval': .1,
+     'fields': (
+         # 14 bits from byte 2 (high) and byte 5 (low)
+         {'pos': 2, 'width': 4, 'name': 'dcBatteryCurrent',
+          'lambda': lambda v: (v >> 16 & 0x3f00 | v & 0xff) - 0x2000, 'scale': .1},
+         )},
+    {'can_id': 0x448, 'interval': .1,
+     'fields': (
+         {'pos': 6, 'width': 2, 'name': 'dcBatteryVoltage', 'scale': .1},
+         )},
+    {'can_id': 0x3d5,
+     'fields': (
+         {'pos': 3, 'name': 'auxBatteryVoltage', 'scale': .1},
+         )},
+    {'can_id': 0x412,
+     'fields': (
+         {'pos': 2, 'width': 3, 'name': 'odo'},
+         )},
+    {'computed': True,
+     'fields': (
+         {'name': 'dcBatteryPower',
+          'lambda': lambda d: d['dcBatteryCurrent'] * d['dcBatteryVoltage'] / 1000},
+         )},
+    )
 
 Fields = (
         {'cmd': BattHVStatus, 'cantx': 0x7e7, 'canrx': 0x7ef, 'autopad': True,
@@ -96,10 +122,9 @@ class SmartED(Car):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_11_500')
         #self._isotp = IsoTpDecoder(self._dongle, Fields)
-        self._reader_thread = Thread(name="SmartED-Reader-Thread", target=self._reader_thread)
+        self._decoder = BroadcastDecoder(self._dongle, Frames)
+        self._reader_thread = Thread(name="SmartED-Reader-Thread", target=self.reader_thread)
         self._reader_running = False
-        self._data = {}
-        self._data_lock = Lock()
         self._last_data = 0
 
     def start(self):
@@ -114,62 +139,21 @@ class SmartED(Car):
         Car.stop(self)
 
     def reader_thread(self):
-        filter_idx = 0
-        filters_len = len(RawFilters)
-        dongle = self._dongle
-        data = self._data
-        data.update(self.get_base_data())
-
-        dongle.set_raw_filters_ex((RawFilters[filter_idx]))
+        self._dongle.set_raw_filters_ex(self._decoder.get_filters())
 
         while self._reader_running:
             try:
-                data = dongle.read_raw_frame(1)
+                self._decoder.read_frames(1)
                 self._last_data = monotonic()
-
-                with self._data_lock:
-                    can_id = data['can_id']
-                    msg = data['data']
-
-                    if self._log.isEnabledFor(logging.DEBUG):
-                        self._log.debug("data can_id(%x) msg(%s)", can_id, msg.hex())
-
-                    success = True
-
-                    if can_id == 0x518:
-                        data['SOC_DISPLAY'] = msg[7] / 2
-                    elif can_id == 0x2d5:
-                        data['SOC_BMS'] = ((msg[4] & 0x03) << 8) + msg[5]
-                    elif can_id == 0x508:
-                        data['dcBatteryCurrent'] = (((msg[2] & 0x3f) << 8) + msg[5] - 0x2000) * .1
-                    elif can_id == 0x448:
-                        data['dcBatteryVoltage'] = ((msg[6] << 8) + msg[7]) * .1
-                    elif can_id == 0x3d5:
-                        data['auxBatteryVoltage'] = msg[3] * .1
-                    elif can_id == 0x412:
-                        data['odo'] = (msg[2] << 16) + (msg[3] << 8) + msg[4]
-                    else:
-                        success = False
-
-                    if success:
-                        if (can_id in (0x508, 0x448) and
-                                'dcBatteryCurrent' in self._data and
-                                'dcBatteryVoltage' in self._data):
-                            data['dcBatteryPower'] = \
-                                data['dcBatteryCurrent'] * data['dcBatteryVoltage'] / 1000
-
-                        filter_idx = (filter_idx + 1) % filters_len
-                        dongle.set_raw_filters_ex((RawFilters[filter_idx]))
-
-            except NoData:
+            except (NoData, CanError):
                 self._log.debug('NoData')
 
     def read_dongle(self, data):
         """ Fetch data from CAN-bus and decode it.
             "data" needs to be a dictionary that will
             be modified with decoded data """
-        with self._data_lock:
-            data.update(self._data)
+        data.update(self.get_base_data())
+        data.update(self._decoder.get_data())
 
     def get_base_data(self):
         return {
@@ -1,9 +1,59 @@
 """ Module for the Renault Zoe Z.E.40 """
 from time import monotonic
-from threading import Thread, Lock
-import logging
-from .car import Car, ifbu, ifbs
-from dongle import NoData
+from threading import Thread
+from .car import Car
+from .broadcast_decoder import BroadcastDecoder
+from dongle import NoData, CanError
+
+Frames = (
+    {'can_id': 0x42e,
+     'fields': (
+         {'pos': 0, 'width': 2, 'name': 'SOC_DISPLAY', 'shift': 3, 'mask': 0x1fff, 'scale': .02},
+         {'pos': 3, 'width': 2, 'name': 'dcBatteryVoltage', 'shift': 5, 'mask': 0x3ff, 'scale': .5},
+         {'pos': 5, 'width': 2, 'name': 'batteryMaxTemperature', 'shift': 5, 'mask': 0x7f, 'offset': -40},
+         {'pos': 5, 'width': 2, 'name': 'batteryMinTemperature', 'shift': 5, 'mask': 0x7f, 'offset': -40},
+         )},
+    #{'can_id': 0x637,
+    # 'fields': (
+    #     {'pos': 5, 'width': 2, 'name': 'cumulativeEnergyCharged', 'shift': 4, 'mask': 0xfff},
+    #     )},
+    {'can_id': 0x5d7,
+     'fields': (
+         {'pos': 2, 'width': 4, 'name': 'odo', 'shift': 4, 'scale': .01},
+         )},
+    {'can_id': 0x638,
+     'fields': (
+         {'pos': 0, 'name': 'dcBatteryPower', 'offset': -80.0},
+         )},
+    #{'can_id': 0x652,
+    # 'fields': (
+    #     {'pos': 4, 'width': 2, 'name': 'cumulativeEnergyDischarged', 'mask': 0x3fff},
+    #     )},
+    {'can_id': 0x654,
+     'fields': (
+         {'pos': 0, 'name': 'normalChargePort', 'bit': 5},
+         )},
+    {'can_id': 0x656,
+     'fields': (
+         {'pos': 6, 'name': 'externalTemperature', 'offset': -40.0},
+         )},
+    {'can_id': 0x658,
+     'fields': (
+         {'pos': 4, 'name': 'soh', 'mask': 0x7f},
+         {'pos': 5, 'name': 'charging', 'bit': 5},
+         )},
+    {'can_id': 0x6f8,
+     'fields': (
+         {'pos': 2, 'name': 'auxBatteryVoltage', 'scale': .0625},
+         )},
+    {'computed': True,
+     'fields': (
+         {'name': 'dcBatteryCurrent',
+          'lambda': lambda d: d['dcBatteryPower'] * 1000 / d['dcBatteryVoltage']
+                              if d['dcBatteryVoltage'] else 0.0},
+         )},
+    )
+
 
 class Zoe(Car):
 
@@ -13,27 +63,10 @@ class Zoe(Car):
 
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_11_500')
-        self._dongle.set_raw_filters_ex([
-            {'id': 0x1f6, 'mask': 0x7ff},
-            {'id': 0x29a, 'mask': 0x7ff},
-            {'id': 0x35c, 'mask': 0x7ff},
-            {'id': 0x427, 'mask': 0x7ff},
-            {'id': 0x42e, 'mask': 0x7ff},
-            {'id': 0x5d7, 'mask': 0x7ff},
-            {'id': 0x637, 'mask': 0x7ff},
-            {'id': 0x638, 'mask': 0x7ff},
-            {'id': 0x652, 'mask': 0x7ff},
-            {'id': 0x654, 'mask': 0x7ff},
-            {'id': 0x656, 'mask': 0x7ff},
-            {'id': 0x658, 'mask': 0x7ff},
-            {'id': 0x6f8, 'mask': 0x7ff},
-            {'id': 0x7bb, 'mask': 0x7ff},
-            ])
-        self._data = self.get_base_data()
-        self._data = {}
-        self._data_lock = Lock()
+        self._decoder = BroadcastDecoder(self._dongle, Frames)
+        self._dongle.set_raw_filters_ex(self._decoder.get_filters())
         self._last_data = 0
-        self._reader_thread = Thread(name="Zoe-Reader-Thread", target=self._reader_thread)
+        self._reader_thread = Thread(name="Zoe-Reader-Thread", target=self.reader_thread)
         self._reader_running = False
 
     def start(self):
@@ -50,81 +83,13 @@ class Zoe(Car):
     def reader_thread(self):
         while self._reader_running:
             try:
-                data = self._dongle.read_raw_frame(1)
+                self._decoder.read_frames(1)
                 self._last_data = monotonic()
-
-                with self._data_lock:
-                    can_id = data['can_id']
-                    msg = data['data']
-
-                    if self._log.isEnabledFor(logging.DEBUG):
-                        self._log.debug("data can_id(%x) msg(%s)", can_id, msg.hex())
-
-                    if can_id == 0x42e:
-                        self._data.update({
-                            'SOC_DISPLAY':                  (ifbu(msg[0:2]) >> 3 & 0x1fff) * 0.02,
-                            })
-                        self._data.update({
-                            'dcBatteryVoltage':             (ifbu(msg[3:5]) >> 5 & 0x03ff) * 0.5,
-                            'batteryMaxTemperature':        (ifbu(msg[5:7]) >> 5 & 0x007f) - 40,
-                            'batteryMinTemperature':        (ifbu(msg[5:7]) >> 5 & 0x007f) - 40,
-                            })
-                        if 'dcBatteryPower' in self._data:
-                            self._data['dcBatteryCurrent'] = \
-                                self._data['dcBatteryPower'] / self._data['dcBatteryVoltage']
-                    #elif can_id == 0x637:
-                    #    self._data.update({
-                    #        'cumulativeEnergyCharged':      ifbu(msg[5:7]) >> 4 & 0x0fff,
-                    #        })
-                    elif can_id == 0x5d7:
-                        self._data.update({
-                            'odo':                          (ifbu(msg[2:6]) >> 4) * 0.01,
-                            })
-                    elif can_id == 0x638:
-                        self._data.update({
-                            'dcBatteryPower':               msg[0] - 80.0,
-                            })
-                        if 'dcBatteryVoltage' in self._data:
-                            self._data['dcBatteryCurrent'] = \
-                                self._data['dcBatteryPower'] / self._data['dcBatteryVoltage']
-                    #elif can_id == 0x652:
-                    #    self._data.update({
-                    #        'cumulativeEnergyDischarged':   ifbu(msg[4:6]) & 0x3fff,
-                    #        })
-                    elif can_id == 0x654:
-                        cpc = msg[0] >> 5 & 0x1
-                        #ect = msg[2] >> 6 & 0x3
-
-                        self._data.update({
-                            'normalChargePort':             int(cpc == 1),
-                            })
-                    elif can_id == 0x656:
-                        self._data.update({
-                            'outcan_ideTemp':               msg[6] - 40.0,
-                            })
-                    elif can_id == 0x658:
-                        self._data.update({
-                            'charging':                     msg[5] >> 5 & 0x1,
-                            'soh':                          msg[4] & 0x7f,
-                            })
-                    elif can_id == 0x6f8:
-                        self._data.update({
-                            'auxBatteryVoltage':            msg[2] * 0.0625,
-                            })
-                    #elif can_id == 0x7bb:
-                    #    self._data.update({
-                    #        'SOC_BMS':                      msg[] * 0.01,
-                    #        })
-                    #elif can_id == 0x7ec:
-                    #    self._data.update({
-                    #        '
-
-            except NoData:
+            except (NoData, CanError):
                 self._log.debug('NoData')
 
     def read_dongle(self, data):
-        with self._data_lock:
-            data.update(self._data)
+        data.update(self._decoder.get_data())
 
     def get_base_data(self):
         raise NotImplementedError()
@@ -34,7 +34,7 @@ Fields = [
             'fields': ({'name': 'dcBatteryVoltage', 'scale': .001})},
         {'cmd': CMD_BMS_ENERGY, 'canrx': LBC_RX, 'cantx': LBC_TX, 'simple': True,
             'fields': ({'name': 'cumulativeEnergyCharged', 'scale': .001})},
-        {'cmd': CMD_ODO, 'canrx': EVC_RX, 'cantx': EVC_TX,
+        {'cmd': CMD_ODO, 'canrx': EVC_RX, 'cantx': EVC_TX, 'refresh': 60,
             'fields': (
                 {'padding': 3},
                 {'name': 'odo', 'width': 3},
@@ -72,7 +72,8 @@ class ZoeZe50(Car):
         Car.__init__(self, config, dongle, watchdog, gps)
         self._dongle.set_protocol('CAN_29_500')
 
-        self._isotp = IsoTpDecoder(self._dongle, Fields)
+        self._isotp = IsoTpDecoder(self._dongle, Fields, config.get('isotp'),
+                                  car_type=config.get('type'))
 
     def read_dongle(self, data):
         """ Read and parse data from dongle """
@@ -6,6 +6,7 @@ Modules = {
     'PiOBD2Hat': {'f': 'pi_obd_hat', 'c': 'PiObd2Hat'},
     'SocketCAN': {'f': 'socket_can', 'c': 'SocketCan'},
     'FakeDongle': {'f': 'fake_dongle', 'c': 'FakeDongle'},
+    'Replay': {'f': 'trace', 'c': 'ReplayDongle'},
 }
 
 
@@ -142,10 +142,11 @@ class AtBase:
 
         return data
 
-    def send_command_ex(self, cmd, cantx, canrx):
+    def send_command_ex(self, cmd, cantx, canrx, fc_opts=None):
         """ Convert bytearray "cmd" to string,
             send to dongle and parse the reponse.
-            Also handles filters and masks. """
+            Also handles filters and masks. fc_opts is not supported
+            and ignored. """
         cmd = cmd.hex()
         self.set_can_id(cantx)
         self.set_can_rx_filter(canrx)
@@ -162,6 +163,7 @@ class AtBase:
         try:
             data = None
             data_len = 0
+            data_pos = 0
             last_idx = 0
             raw = str(ret, 'ascii').split('\r\n')
 
@@ -178,12 +180,16 @@ class AtBase:
                     self._log.debug("%s single frame", line)
                     data_len = int(line[offset+1:offset+2], 16)
                     data = bytes.fromhex(line[offset+2:data_len*2+offset+2])
+                    data_pos = len(data)
                     break
 
                 elif frame_type == 1:   # First frame
                     self._log.debug("%s first frame", line)
                     data_len = int(line[offset+1:offset+4], 16)
-                    data = bytearray.fromhex(line[offset+4:])
+                    # Reassemble into a buffer of the announced length
+                    data = memoryview(bytearray(data_len))
+                    data_pos = min(6, data_len)
+                    data[:data_pos] = bytes.fromhex(line[offset+4:offset+4+data_pos*2])
                     last_idx = 0
 
                 elif frame_type == 2:   # Consecutive frame
@@ -193,12 +199,13 @@ class AtBase:
                         raise CanError("Bad frame order: last_idx(%d) idx(%d)" %
                                        (last_idx, idx))
 
-                    frame_len = min(7, data_len - len(data))
-                    data.extend(bytearray.fromhex(
-                        line[offset+2:frame_len*2+offset+2]))
+                    frame_len = min(7, data_len - data_pos)
+                    data[data_pos:data_pos+frame_len] = bytes.fromhex(
+                        line[offset+2:frame_len*2+offset+2])
+                    data_pos += frame_len
                     last_idx = idx
 
-                    if data_len == len(data):
+                    if data_len == data_pos:
                         break
 
                 else:                   # Unexpected frame
@@ -207,9 +214,9 @@ class AtBase:
             if not data or data_len == 0:
                 raise NoData('NO DATA')
 
-            if data_len != len(data):
+            if data_len != data_pos:
                 raise CanError("Data length mismatch %s: %d vs %d %s" %
-                               (cmd, data_len, len(data), data.hex()))
+                               (cmd, data_len, data_pos, data[:data_pos].hex()))
 
         except ValueError:
             raise CanError("Failed Command %s\n%s" % (cmd, ret))
@@ -1,4 +1,8 @@
 """ Dongle for testing """
+from random import Random
+from threading import Lock
+from time import monotonic, sleep
+from . import NoData, CanError
 
 B = bytes.fromhex
 
@@ -70,6 +74,12 @@ data = {
                                     2273003B3A0000
                                     7A130096960000""")[:0x019],
             },
+        0x7e2: {
+            B2101:   bytes.fromhex("""6101FFFFFFFF
+                                    00010000000000
+                                    00000000000000
+                                    00000000000000""")[:0x016],
+            },
         0x7c6: {
             B22b002: bytes.fromhex("""62B002E00000
                                     0000AD00B56C00
@@ -118,6 +128,9 @@ data = {
                                     00FFB300862900
                                     00000000000000""")[:0x00f],
             },
+        0x7b3: {
+            B220100: B('62 01 00 00 00 00 00 00 7a 6e 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00'),
+            },
         },
     'EV6': {
         0x744: {
@@ -126,7 +139,8 @@ data = {
         0x7a0: {
             B22c00b: B('62 c0 0b ff ff ff 80 b5 3f 00 04 00 b6 41 00 04 00 b5 40 00 04 00 b8 41 00 04 00 3d 99 b0 9b b0 9a b0 9b b0')},
         0x7b3: {
-            B220100: B('62 01 00 7f d4 07 c8 ff 71 69 52 00 df 56 00 e4 56 ff 1c ff 96 ff ff ff ff ff ff ff 37 1b 75 73 00 ff ff 01')},
+            B220100: B('62 01 00 7f d4 07 c8 ff 71 69 52 00 df 56 00 e4 56 ff 1c ff 96 ff ff ff ff ff ff ff 37 1b 75 73 00 ff ff 01'),
+            B220102: B('62 01 02 ff ff ff ff 78 76 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00')},
         0x7c6: {
             B22b002: B('62 b0 02 e0 00 00 00 ff b5 00 03 9a 00 00 00')},
         0x7e4: {
@@ -147,15 +161,213 @@ data = {
         0x7e5: {
             B22e011: B('62 E0 11 FF FF FF F8 01 01 00 00 00 70 38 30 04 1B 1D 0C 37 90 80 0B 61 20 6B 00 66 08 01 01 01 00 0A 00 00 12 00 07 00 00 00 00 00 00 00 00 00 00'),
             },
-        }
+        },
+    'KONA_EV': {
+        0x7e4: {
+            B220101: B('62 01 01 ff ff ff ff 91 00 00 00 00 00 ff e9 0e 8c 12 10 11 10 12 11 00 00 11 00 00 00 00 00 00 8e 00 06 4a b9 00 06 15 a9 00 02 53 1b 00 02 2f 73 00 4e 2d 80 00 00 00 00 00 00 00 00 00'),
+            B220102: B('62 01 02 ff ff ff ff c2 c1 c1 c2 c2 c1 c3 c1 c2 c1 c2 c3 c2 c1 c2 c2 c3 c1 c1 c3 c3 c2 c2 c2 c1 c3 c2 c2 c2 c1 c2 c2'),
+            B220103: B('62 01 03 ff ff ff ff c2 c2 c3 c1 c3 c3 c3 c1 c3 c2 c2 c2 c2 c2 c3 c2 c2 c3 c2 c3 c1 c3 c1 c2 c1 c1 c3 c1 c2 c2 c2 c2'),
+            B220104: B('62 01 04 ff ff ff ff c1 c2 c2 c1 c1 c1 c2 c2 c1 c2 c2 c2 c2 c3 c3 c2 c2 c2 c3 c2 c2 c2 c3 c3 c2 c2 c1 c1 c2 c3 c1 c2'),
+            B220105: B('62 01 05 ff ff ff ff 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 03 e8 00 00 00 00 99 00 00 00 00 00 00 00 00 00 00 00'),
+            },
+        0x7c6: {
+            B22b002: B('62 b0 02 00 00 00 00 00 00 00 5b a0 00 00 00'),
+            },
+        0x7b3: {
+            B220100: B('62 01 00 00 00 00 00 00 7b 68 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00'),
+            },
+        },
+    'NIRO_EV': {
+        0x7e4: {
+            B220101: B('62 01 01 ff ff ff ff 6e 00 00 00 00 00 fe 9b 0e 1c 12 10 11 10 12 11 00 00 11 00 00 00 00 00 00 8e 00 06 4a b9 00 06 15 a9 00 02 53 1b 00 02 2f 73 00 4e 2d 80 00 00 00 00 00 00 00 00 00'),
+            B220102: B('62 01 02 ff ff ff ff bc bd bc bd bd bd bd bd bd bc bc bd bd be bd bc bd bd bd bd bd bd bd be be be bc be bc bc bd bc'),
+            B220103: B('62 01 03 ff ff ff ff bc bd be bd bd be bd bc bd bc bd bd be bc bd bd be bc bc bd bd bd be bd bd bc bd be bd bc bd bd'),
+            B220104: B('62 01 04 ff ff ff ff bd bd be bd bc bc bd bd bd bd bd bd bc bd bd be bd bd bc bd bd bc bd bd bd bd bd be bd bd bc bd'),
+            B220105: B('62 01 05 ff ff ff ff 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 03 d9 00 00 00 00 75 00 00 00 00 00 00 00 00 00 00 00'),
+            },
+        0x7c6: {
+            B22b002: B('62 b0 02 00 00 00 00 00 00 00 ef 32 00 00 00'),
+            },
+        0x7b3: {
+            B220100: B('62 01 00 00 00 00 00 00 7b 59 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00'),
+            },
+        },
+    'ZOE_ZE50': {
+        0x18dadaf1: {
+            B('222005'): B('62 20 05 05 9c'),
+            B('222006'): B('62 20 06 00 87 07'),
+            },
+        0x18dadef1: {
+            B('225017'): B('62 50 17 00'),
+            },
+        0x18dadbf1: {
+            B('229002'): B('62 90 02 19 32'),
+            B('229001'): B('62 90 01 19 d4'),
+            B('229006'): B('62 90 06 05 d1 46'),
+            B('229245'): B('62 92 45 00 41 ef d2'),
+            B('229257'): B('62 92 57 7f 81'),
+            },
+        },
+    'E208': {
+        0x694: {
+            B('22d815'): B('62 d8 15 63 04'),
+            B('22d816'): B('62 d8 16 00 00 19 00'),
+            B('22d86f'): B('62 d8 6f 0f 48'),
+            B('22d870'): B('62 d8 70 0f 51'),
+            B('22d8ef'): B('62 d8 ef 13'),
+            B('22d410'): B('62 d4 10 93 00'),
+            B('22d860'): B('62 d8 60 06 18'),
+            },
+        0x682: {
+            B('22d434'): B('62 d4 34 0b'),
+            },
+        },
+    'MG_ZS_EV': {
+        0x7e3: {
+            B('220112'): B('62 01 12 8b'),
+            B('22b71b'): B('62 b7 1b 00'),
+            },
+        0x781: {
+            B('22b046'): B('62 b0 46 02 ab'),
+            B('22b042'): B('62 b0 42 06 49'),
+            B('22b043'): B('62 b0 43 9a ee'),
+            B('22b061'): B('62 b0 61 26 94'),
+            },
+        0x760: {
+            B('22b101'): B('62 b1 01 00 49 4d'),
+            },
+        0x750: {
+            B('22e01b'): B('62 e0 1b 02 17'),
+            },
+        },
+    }
+
+# Broadcast frames of cars decoded from raw CAN, by can_id: (period, payload)
+frames = {
+    'ZOE_Q210': {
+        0x42e: (.1, B('7d 00 00 5a 00 07 80 00')),
+        0x5d7: (.1, B('00 00 01 2d 68 70 00 00')),
+        0x638: (.1, B('55 00 00 00 00 00 00 00')),
+        0x654: (.5, B('00 00 00 00 00 00 00 00')),
+        0x656: (1., B('00 00 00 00 00 00 3c 00')),
+        0x658: (1., B('00 00 00 00 5f 00 00 00')),
+        0x6f8: (.1, B('00 00 c8 00 00 00 00 00')),
+        },
+    'SMART_ED': {
+        0x518: (.1, B('00 00 00 00 00 00 00 96')),
+        0x2d5: (.1, B('00 00 00 00 02 ee 00 00')),
+        0x508: (.01, B('00 00 20 00 00 00 00 00')),
+        0x448: (.01, B('00 00 00 00 00 00 0d ac')),
+        0x3d5: (.1, B('00 00 00 7d 00 00 00 00')),
+        0x412: (.1, B('00 00 00 5b a0 00 00 00')),
+        },
     }
 
+
+def can_frames(length):
+    """ Number of CAN frames of an ISO-TP message. The first frame of a
+        multi-frame message carries 6 bytes, consecutive frames 7 """
+    return 1 if length <= 7 else 2 + (length - 7) // 7
+
+
 class FakeDongle:
+    """ Dongle answering from the fixtures above. Optionally simulates
+        response times and faults, see 'latency' in config.yaml.template """
+
     def __init__(self, config):
-        self._data = data[config['car_type']]
+        self._data = data.get(config['car_type'], {})
+        self._frames = frames.get(config['car_type'], {})
+        self._latency = config.get('latency') or {}
+        self._ecus = self._latency.get('ecus', {})
+        self._random = Random(self._latency.get('seed'))
+        self._start = monotonic()
+        # Without a latency model all answers are instant and raw frames
+        # arrive on a simulated clock
+        self._realtime = bool(self._latency)
+        self._bus_time = 0.
+        self.supports_concurrency = self._latency.get('concurrent', False)
+        # One lock per ECU if concurrent, otherwise one for the whole bus
+        self._locks = {}
+        self._filters = [{'id': 0, 'mask': 0}]
+        self._next_frame = {can_id: 0. for can_id in self._frames}
+
+    def _model(self, cantx, key, default=0):
+        """ Return a latency model parameter of an ECU """
+        return self._ecus.get(cantx, {}).get(key, self._latency.get(key, default))
+
+    def _now(self):
+        return monotonic() - self._start if self._realtime else self._bus_time
+
+    def _asleep(self, cantx):
+        now = self._now()
+        return any(start <= now < end for start, end in self._model(cantx, 'asleep', ()))
+
+    def send_command_ex(self, cmd, cantx, canrx, fc_opts=None):
+        response = self._data.get(cantx, {}).get(cmd)
+        if not self._realtime:
+            if response is None:
+                raise NoData('NO DATA')
+            return response
+
+        lock = self._locks.setdefault(cantx if self.supports_concurrency else None, Lock())
+        with lock:
+            if (response is None or self._asleep(cantx) or
+                    self._random.random() < self._model(cantx, 'nodata')):
+                sleep(self._model(cantx, 'timeout', .2))
+                raise NoData('NO DATA')
+
+            sleep(self._model(cantx, 'base') +
+                  (can_frames(len(cmd)) + can_frames(len(response))) * self._model(cantx, 'frame') +
+                  self._random.uniform(0, self._model(cantx, 'jitter')))
+
+            if self._random.random() < self._model(cantx, 'canerror'):
+                raise CanError("Failed Command %s: simulated error" % cmd.hex(' '))
+
+        return response
+
+    def read_raw_frame(self, timeout=None):
+        """ Return the next due broadcast frame passing the filters """
+        due, can_id = min(((due, can_id) for can_id, due in self._next_frame.items()
+                           if any(can_id & f['mask'] == f['id'] & f['mask']
+                                  for f in self._filters)),
+                          default=(float('inf'), None))
+
+        now = self._now()
+        if timeout is not None and due - now > timeout:
+            if self._realtime:
+                sleep(timeout)
+            else:
+                self._bus_time += timeout
+            raise NoData('NO DATA')
+
+        if can_id is None:
+            # No fixture passes the filters, don't wait forever
+            raise NoData('NO DATA')
+
+        if self._realtime:
+            sleep(max(0, due - now))
+        else:
+            self._bus_time = max(due, now)
+
+        period, payload = self._frames[can_id]
+        self._next_frame[can_id] = max(due, now) + period
+        return {
+            'can_id': can_id,
+            'data_len': len(payload),
+            'data': payload,
+            }
+
+    def set_raw_mask(self, mask):
+        """ Set the can receive mask of the raw frames """
+        self._filters = [{'id': self._filters[0]['id'], 'mask': mask}]
+
+    def set_raw_filter(self, addr):
+        """ Set the can receive filter of the raw frames """
+        self._filters = [{'id': addr, 'mask': self._filters[0]['mask']}]
 
-    def send_command_ex(self, cmd, cantx, canrx):
-        return self._data[cantx][cmd]
+    def set_raw_filters_ex(self, filters):
+        """ Set filters of the raw frames """
+        self._filters = list(filters)
 
     def set_protocol(self, bla):
         pass
@@ -1,12 +1,15 @@
 """ Module implementing an interface through Linux's socket CAN interface """
-from time import sleep
-from socket import (socket, timeout as sock_timeout,
+from time import sleep, monotonic, time
+from collections import deque
+from threading import Lock, local
+from socket import (socket, timeout as sock_timeout, CMSG_SPACE, SOL_SOCKET,
                     AF_CAN, PF_CAN, SOCK_DGRAM, SOCK_RAW, CAN_ISOTP,
-                    CAN_RAW, CAN_EFF_FLAG, CAN_EFF_MASK, CAN_RAW_FILTER,
+                    CAN_RAW, CAN_BCM, CAN_EFF_FLAG, CAN_EFF_MASK, CAN_RAW_FILTER,
                     SOL_CAN_BASE, SOL_CAN_RAW)
 from struct import Struct, pack
 import logging
 import sys
+from numpy import dtype, frombuffer
 from pyroute2 import IPRoute
 from . import NoData, CanError
 
@@ -30,7 +33,62 @@ CAN_ISOTP_RX_PADDING = 0x8
 CAN_ISOTP_CHK_PAD_LEN = 0x10
 CAN_ISOTP_CHK_PAD_DATA = 0x20
 
+# Not exported by the socket module, SCM_TIMESTAMP has the same value
+SO_TIMESTAMP = 29
+
+CAN_BCM_RX_SETUP = 5
+CAN_BCM_RX_DELETE = 6
+CAN_BCM_RX_CHANGED = 12
+CAN_BCM_SETTIMER = 0x1
+CAN_BCM_RX_FILTER_ID = 0x20
+CAN_BCM_RX_CHECK_DLC = 0x40
+
 CANFMT = Struct("<IB3x8s")
+CANHDR = Struct("<IB3x")
+# struct bcm_msg_head: opcode, flags, count, ival1 and ival2 (struct timeval),
+# can_id, nframes, padded to the alignment of the following can_frames
+BCMHDR = Struct("@3I4l2I0q")
+TIMEVAL = Struct("@ll")
+
+# Frames returned by read_raw_frames: struct can_frame followed by the time
+# it was read (monotonic)
+RawFrame = dtype([('can_id', '<u4'), ('dlc', 'u1'), ('pad', 'V3'), ('data', 'V8'),
+                  ('timestamp', '<f8')])
+RAW_BATCH = 256
+
+
+def cmsg_timestamp(ancdata):
+    """ Returns the (wall clock) time the kernel received a message from
+        its SO_TIMESTAMP ancillary data, or the current time """
+    for level, kind, cdata in ancdata:
+        if level == SOL_SOCKET and kind == SO_TIMESTAMP and len(cdata) >= TIMEVAL.size:
+            sec, usec = TIMEVAL.unpack_from(cdata)
+            return sec + usec * 1e-6
+    return time()
+
+
+def recv_timestamped(sock, bufsize):
+    """ Receive a message from a socket with SO_TIMESTAMP enabled.
+        Returns the message and the (wall clock) time the kernel received it. """
+    msg, ancdata, _, _ = sock.recvmsg(bufsize, CMSG_SPACE(TIMEVAL.size))
+    return msg, cmsg_timestamp(ancdata)
+
+
+def recv_into_timestamped(sock, buf):
+    """ Like recv_timestamped, but receives into buf and only returns the
+        time. """
+    _, ancdata, _, _ = sock.recvmsg_into((buf,), CMSG_SPACE(TIMEVAL.size))
+    return cmsg_timestamp(ancdata)
+
+
+def link_bitrate(link):
+    """ Returns the bitrate of a CAN link as reported by pyroute2, or None
+        if it is not configured """
+    try:
+        return link.get_attr('IFLA_LINKINFO').get_attr('IFLA_INFO_DATA') \
+                   .get_attr('IFLA_CAN_BITTIMING')['bitrate']
+    except (AttributeError, KeyError, TypeError):
+        return None
 
 
 def can_str(msg):
@@ -39,6 +97,39 @@ def can_str(msg):
     return "%x#%s (%d)" % (can_id & CAN_EFF_MASK, data.hex(' '), length)
 
 
+class AdaptiveTimeout:
+    """ Response timeout of one command, following a high percentile of
+        its recent response times. A timeout doubles it for the next try only,
+        so slow answers are caught while dead ECUs are still detected
+        quickly. """
+
+    def __init__(self, initial=0.2, floor=0.05, ceiling=1.0, factor=2.0,
+                 percentile=95, window=32):
+        self._floor = floor
+        self._ceiling = ceiling
+        self._factor = factor
+        self._percentile = percentile
+        self._samples = deque(maxlen=window)
+        self._learned = initial
+        self._widen = 1
+        self.timeout = initial
+
+    def success(self, latency):
+        """ Account the response time of an answered request """
+        self._samples.append(latency)
+        if len(self._samples) >= self._samples.maxlen // 4:
+            ordered = sorted(self._samples)
+            high = ordered[min(len(ordered) - 1, len(ordered) * self._percentile // 100)]
+            self._learned = min(max(high * self._factor, self._floor), self._ceiling)
+        self._widen = 1
+        self.timeout = self._learned
+
+    def failure(self):
+        """ Account a request that timed out """
+        self._widen = 2 if self._widen == 1 else 1
+        self.timeout = min(self._learned * self._widen, self._ceiling)
+
+
 class CanSocket(socket):
     """ Extend socket class with some helper functions """
 
@@ -100,27 +191,83 @@ class SocketCan:
         self._config = config
 
         self._is_extended = False
+        # Requests to different ECUs may be in flight at the same time
+        self.supports_concurrency = False
+
+        # Bound ISO-TP sockets, keyed by (canrx, cantx, fc_opts)
+        self._isotp_socks = {}
+        self._isotp_socks_lock = Lock()
+
+        # Response timeouts, keyed by (cantx, canrx, cmd). Per command, as
+        # multi frame responses take far longer than single frames.
+        self._timeouts = {}
+
+        # Send and receive time of the last command, per thread
+        self._timing = local()
+
+        # Broadcast manager receive operations by can_id, with the time
+        # of their next heartbeat
+        self._bcm_sock = None
+        self._bcm_filters = {}
+        self._bcm_heartbeat = config.get('bcm_heartbeat', 10.)
+        self._bcm_next_heartbeat = 0
+
+        # Result of the CAN_ISOTP probe, done once
+        self._isotp_supported = None
+        self._can_raw_sock = None
 
         self.init_dongle()
 
     def init_dongle(self):
         """ Set up the network interface and initialize socket """
+        self.setup_link()
+        self.setup_sockets()
+
+    def setup_link(self):
+        """ Bring the interface up with the configured bitrate. A link that
+            is already up with that bitrate is left alone, so no frames
+            are lost by bouncing it. """
         ip_route = IPRoute()
-        ifidx = ip_route.link_lookup(ifname=self._config['port'])[0]
-        link = ip_route.link('get', index=ifidx)
-        if 'state' in link[0] and link[0]['state'] == 'up':
-            ip_route.link('set', index=ifidx, state='down')
-            sleep(1)
-
-        ip_route.link('set', index=ifidx, type='can',
-                      txqlen=4000, bitrate=self._config['speed'],
-                      state='up')
-        ip_route.close()
-
-        # test if kernel supports CAN_ISOTP
         try:
-            sock = CanSocket(AF_CAN, SOCK_DGRAM, CAN_ISOTP)
-            sock.close()
+            ifidx = ip_route.link_lookup(ifname=self._config['port'])[0]
+            link = ip_route.link('get', index=ifidx)[0]
+            bitrate = link_bitrate(link)
+            if link.get('state') == 'up':
+                if bitrate == self._config['speed']:
+                    self._log.info("%s already up at %d bit/s",
+                                   self._config['port'], bitrate)
+                    return
+                ip_route.link('set', index=ifidx, state='down')
+                sleep(1)
+
+            self._log.info("Setting up %s at %d bit/s (was %s)",
+                           self._config['port'], self._config['speed'], bitrate)
+            ip_route.link('set', index=ifidx, type='can',
+                          txqlen=4000, bitrate=self._config['speed'],
+                          state='up')
+        finally:
+            ip_route.close()
+
+    def probe_isotp(self):
+        """ Test once if the kernel supports CAN_ISOTP """
+        if self._isotp_supported is None:
+            try:
+                sock = CanSocket(AF_CAN, SOCK_DGRAM, CAN_ISOTP)
+                sock.close()
+                self._isotp_supported = True
+                self._log.info("using ISO-TP support")
+            except OSError as err:
+                if err.errno != 93:
+                    raise
+                # CAN_ISOTP not supported
+                self._isotp_supported = False
+        return self._isotp_supported
+
+    def setup_sockets(self):
+        """ (Re-)create the sockets, e.g. after a protocol change """
+        self.close_isotp_sockets()
+
+        if self.probe_isotp():
             # CAN_ISOTP_TX_PADDING CAN_ISOTP_RX_PADDING CAN_ISOTP_CHK_PAD_LEN CAN_ISOTP_CHK_PAD_DATA
             opts = CAN_ISOTP_TX_PADDING | CAN_ISOTP_RX_PADDING | CAN_ISOTP_CHK_PAD_LEN
             # if self._is_extended:
@@ -129,16 +276,98 @@ class SocketCan:
             self._sock_opt_isotp_fc = pack("=BBB", 0, 0, 0)
             # select implementation of send_command_ex
             self.send_command_ex = self.send_command_ex_isotp
-            self._log.info("using ISO-TP support")
-        except OSError as err:
-            if err.errno == 93:
-                # CAN_ISOTP not supported
-                self.send_command_ex = self.send_command_ex_canraw
-            else:
-                raise
+            self.supports_concurrency = True
+        else:
+            self.send_command_ex = self.send_command_ex_canraw
+            self.supports_concurrency = False
 
+        if self._can_raw_sock is not None:
+            self._can_raw_sock.close()
         self._can_raw_sock = CanSocket(PF_CAN, SOCK_RAW, CAN_RAW)
+        self._can_raw_sock.setsockopt(SOL_SOCKET, SO_TIMESTAMP, 1)
         self._can_raw_sock.bind((self._config['port'],))
+        # Receive buffer of read_raw_frames, one can_frame sized slot per frame
+        raw_buf = memoryview(bytearray(RAW_BATCH * RawFrame.itemsize))
+        self._raw_frames = frombuffer(raw_buf, dtype=RawFrame)
+        self._raw_slots = [raw_buf[pos:pos + CANFMT.size]
+                           for pos in range(0, len(raw_buf), RawFrame.itemsize)]
+
+        if self._bcm_sock is not None:
+            self._bcm_sock.close()
+            self._bcm_sock = None
+        self._bcm_filters = {}
+        if self._config.get('bcm', False):
+            self._bcm_sock = socket(PF_CAN, SOCK_DGRAM, CAN_BCM)
+            self._bcm_sock.setsockopt(SOL_SOCKET, SO_TIMESTAMP, 1)
+            self._bcm_sock.connect((self._config['port'],))
+            self._bcm_msg = memoryview(bytearray(BCMHDR.size + CANFMT.size))
+            self._log.info("using CAN_BCM for raw frames")
+
+    def _get_isotp_socket(self, cantx, canrx, fc_opts):
+        """ Return a bound ISO-TP socket for the given addresses and
+            flow control options. Sockets are created on first use and
+            kept in a pool until invalidated. """
+        key = (canrx, cantx, fc_opts)
+        with self._isotp_socks_lock:
+            entry = self._isotp_socks.get(key)
+            if entry is None:
+                sock = CanSocket(AF_CAN, SOCK_DGRAM, CAN_ISOTP)
+                try:
+                    sock.setsockopt(SOL_CAN_ISOTP, CAN_ISOTP_OPTS,
+                                    self._sock_opt_isotp_opt)
+                    sock.setsockopt(SOL_CAN_ISOTP, CAN_ISOTP_RECV_FC,
+                                    fc_opts or self._sock_opt_isotp_fc)
+                    sock.setsockopt(SOL_SOCKET, SO_TIMESTAMP, 1)
+                    sock.bind((self._config['port'], canrx, cantx))
+                except OSError:
+                    sock.close()
+                    raise
+
+                entry = {'sock': sock, 'uses': 0}
+                self._isotp_socks[key] = entry
+                self._log.debug("new ISO-TP socket canrx(%x) cantx(%x)",
+                                canrx, cantx)
+            else:
+                entry['uses'] += 1
+
+        return key, entry['sock']
+
+    def _drop_isotp_socket(self, key):
+        """ Remove a socket from the pool, e.g. after a timeout. A late
+            response would otherwise be read by the next request. """
+        with self._isotp_socks_lock:
+            entry = self._isotp_socks.pop(key, None)
+        if entry is not None:
+            entry['sock'].close()
+
+    def close_isotp_sockets(self):
+        """ Close all pooled ISO-TP sockets """
+        with self._isotp_socks_lock:
+            entries = list(self._isotp_socks.values())
+            self._isotp_socks.clear()
+        for entry in entries:
+            entry['sock'].close()
+
+    def get_isotp_socket_stats(self):
+        """ Return the number of reuses of every pooled ISO-TP socket,
+            keyed by (canrx, cantx) """
+        with self._isotp_socks_lock:
+            return {(canrx & CAN_EFF_MASK, cantx & CAN_EFF_MASK): entry['uses']
+                    for (canrx, cantx, _), entry in self._isotp_socks.items()}
+
+    def _get_timeout(self, cantx, canrx, cmd):
+        """ Return the adaptive response timeout of a command """
+        timeout = self._timeouts.get((cantx, canrx, cmd))
+        if timeout is None:
+            timeout = self._timeouts.setdefault((cantx, canrx, cmd), AdaptiveTimeout(
+                floor=self._config.get('timeout_min', 0.05),
+                ceiling=self._config.get('timeout_max', 1.0),
+                factor=self._config.get('timeout_factor', 2.0)))
+        return timeout
+
+    def get_timeouts(self):
+        """ Return the current response timeout per (cantx, canrx, cmd) """
+        return {key: timeout.timeout for key, timeout in self._timeouts.items()}
 
     def send_command_ex_isotp(self, cmd, cantx, canrx, fc_opts=None):
         """ Send a command using specified can tx id and
@@ -152,31 +381,41 @@ class SocketCan:
             cantx |= CAN_EFF_FLAG
             canrx |= CAN_EFF_FLAG
 
+        key = None
+        timeout = self._get_timeout(cantx, canrx, cmd)
+        self._timing.last = None
         try:
-            with CanSocket(AF_CAN, SOCK_DGRAM, CAN_ISOTP) as sock:
-                sock.setsockopt(SOL_CAN_ISOTP, CAN_ISOTP_OPTS,
-                                self._sock_opt_isotp_opt)
-                sock.setsockopt(SOL_CAN_ISOTP, CAN_ISOTP_RECV_FC,
-                                fc_opts or self._sock_opt_isotp_fc)
-
-                sock.bind((self._config['port'], canrx, cantx))
-                sock.settimeout(0.2)
-
-                if self._log.isEnabledFor(logging.DEBUG):
-                    self._log.debug("canrx(%s) cantx(%s) cmd(%s)",
-                                    hex(canrx), hex(cantx), cmd.hex(' '))
-                sock.send(cmd)
-                data = sock.recv(512)
-                if self._log.isEnabledFor(logging.DEBUG):
-                    self._log.debug(data.hex(' '))
+            key, sock = self._get_isotp_socket(cantx, canrx, fc_opts)
+
+            if self._log.isEnabledFor(logging.DEBUG):
+                self._log.debug("canrx(%s) cantx(%s) cmd(%s)",
+                                hex(canrx), hex(cantx), cmd.hex(' '))
+            sock.settimeout(timeout.timeout)
+            start = monotonic()
+            sent = time()
+            sock.send(cmd)
+            data, received = recv_timestamped(sock, 512)
+            timeout.success(monotonic() - start)
+            self._timing.last = (sent, received)
+            if self._log.isEnabledFor(logging.DEBUG):
+                self._log.debug(data.hex(' '))
         except sock_timeout as err:
+            timeout.failure()
+            self._drop_isotp_socket(key)
             raise NoData("Command timed out %s: %s" % (cmd.hex(' '), err))
         except OSError as err:
+            self._drop_isotp_socket(key)
             raise CanError("Failed Command %s: %s" % (cmd.hex(' '), err))
 
         if not data or len(data) == 0:
             raise NoData('NO DATA')
 
+        if data[0] != cmd[0] | 0x40:
+            # Negative (e.g. 7f xx 78, response pending) or unexpected
+            # response. The real one may still arrive and would be read
+            # by the next request on this socket.
+            self._drop_isotp_socket(key)
+
         return data
 
     def send_command_ex_canraw(self, cmd, cantx, canrx, fc_opts=None):
@@ -190,6 +429,8 @@ class SocketCan:
             cantx |= CAN_EFF_FLAG
             canrx |= CAN_EFF_FLAG
 
+        timeout = self._get_timeout(cantx, canrx, cmd)
+        self._timing.last = None
         try:
             cmd_len = len(cmd)
             assert cmd_len < 8
@@ -202,31 +443,35 @@ class SocketCan:
                 self._log.debug("%s send messsage", can_str(cmd_msg))
 
             with CanSocket(PF_CAN, SOCK_RAW, CAN_RAW) as sock:
+                sock.setsockopt(SOL_SOCKET, SO_TIMESTAMP, 1)
                 sock.bind((self._config['port'],))
-                sock.settimeout(0.2)
+                sock.settimeout(timeout.timeout)
 
                 sock.set_filters_ex([{
                     'id':   canrx,
                     'mask': 0x1fffffff if self._is_extended else 0x7ff
                     }])
 
+                start = monotonic()
+                sent = time()
                 sock.send(cmd_msg)
 
                 data = None
                 data_len = 0
+                data_pos = 0
                 last_idx = 0
 
                 while True:
                     self._log.debug("waiting recv msg")
-                    msg = sock.recv(72)
-                    can_id, length, msg_data = CANFMT.unpack(msg)
+                    msg, received = recv_timestamped(sock, 72)
+                    can_id, length = CANHDR.unpack_from(msg)
+                    msg_data = memoryview(msg)[CANHDR.size:CANHDR.size + length]
 
                     if self._log.isEnabledFor(logging.DEBUG):
                         self._log.debug("Got %x %i %s", can_id,
                                         length, msg_data.hex(' '))
 
                     can_id &= CAN_EFF_MASK
-                    msg_data = msg_data[:length]
                     frame_type = msg_data[0] & 0xf0
 
                     if frame_type == 0x00:
@@ -234,14 +479,19 @@ class SocketCan:
                             self._log.debug("%s single frame", can_str(msg))
 
                         data_len = msg_data[0] & 0x0f
-                        data = bytes(msg_data[1:data_len+1])
+                        data = msg_data[1:data_len+1]
+                        data_pos = len(data)
+                        break
 
                     elif frame_type == 0x10:
                         if self._log.isEnabledFor(logging.DEBUG):
                             self._log.debug("%s first frame", can_str(msg))
 
-                        data_len = (msg_data[0] & 0x0f) + msg_data[1]
-                        data = bytearray(msg_data[2:])
+                        # Reassemble into a buffer of the announced length
+                        data_len = ((msg_data[0] & 0x0f) << 8) + msg_data[1]
+                        data = memoryview(bytearray(data_len))
+                        data_pos = min(6, data_len, len(msg_data) - 2)
+                        data[:data_pos] = msg_data[2:2+data_pos]
 
                         if self._log.isEnabledFor(logging.DEBUG):
                             self._log.debug("Send flow control message")
@@ -261,11 +511,12 @@ class SocketCan:
                             raise CanError("Bad frame order: last_idx(%d) idx(%d)" %
                                            (last_idx, idx))
 
-                        frame_len = min(7, data_len - len(data))
-                        data.extend(msg_data[1:frame_len+1])
+                        frame_len = min(7, data_len - data_pos, len(msg_data) - 1)
+                        data[data_pos:data_pos+frame_len] = msg_data[1:frame_len+1]
+                        data_pos += frame_len
                         last_idx = idx
 
-                        if data_len == len(data):
+                        if data_len == data_pos:
                             # All frames seen, exit loop
                             break
 
@@ -275,24 +526,37 @@ class SocketCan:
                         raise CanError("Unexpected message: %s" % (can_str(msg)))
 
         except sock_timeout as err:
+            timeout.failure()
             raise NoData("Command timed out %s: %s" % (cmd.hex(' '), err))
         except OSError as err:
             raise CanError("Failed Command %s: %s" % (cmd.hex(' '), err))
 
         if not data or data_len == 0:
             raise NoData('NO DATA')
-        if data_len != len(data):
+        timeout.success(monotonic() - start)
+        self._timing.last = (sent, received)
+        if data_len != data_pos:
             raise CanError("Data length mismatch %s: %d vs %d %s" %
-                           (cmd.hex(' '), data_len, len(data), data.hex(' ')))
+                           (cmd.hex(' '), data_len, data_pos, data[:data_pos].hex(' ')))
 
         return data
 
+    def last_timing(self):
+        """ Return (sent, received) of the last successful command of the
+            calling thread, as wall clock times. received is the time the
+            kernel received the (last frame of the) response. """
+        return getattr(self._timing, 'last', None)
+
     def read_raw_frame(self, timeout=None):
-        """ Read a single frame. """
+        """ Read a single frame. Its timestamp is the (monotonic) time
+            the kernel received it. """
+        if self._bcm_filters:
+            return self._read_bcm_frame(timeout)
+
         try:
             self._can_raw_sock.settimeout(timeout)
 
-            msg = self._can_raw_sock.recv(72)
+            msg, received = recv_timestamped(self._can_raw_sock, 72)
 
             can_id, length, msg_data = CANFMT.unpack(msg)
             can_id &= CAN_EFF_MASK
@@ -303,7 +567,8 @@ class SocketCan:
             data = {
                 'can_id': can_id,
                 'data_len': length,
-                'data': msg_data[:length]
+                'data': msg_data[:length],
+                'timestamp': received - time() + monotonic(),
                 }
 
             return data
@@ -313,6 +578,135 @@ class SocketCan:
         except OSError as err:
             raise CanError("CAN read error: %s" % (err))
 
+    def read_raw_frames(self, timeout=None):
+        """ Read all pending frames, waiting up to timeout for the first.
+            Returns a structured array of RawFrame, a view of a buffer that
+            is overwritten by the next call. Timestamps are the (monotonic)
+            times the kernel received the frames. """
+        if self._bcm_filters:
+            return self._read_bcm_frames(timeout)
+
+        sock = self._can_raw_sock
+        slots = self._raw_slots
+        stamps = []
+        try:
+            sock.settimeout(timeout)
+            stamps.append(recv_into_timestamped(sock, slots[0]))
+            # Drain the frames already queued without waiting
+            sock.settimeout(0)
+            while len(stamps) < RAW_BATCH:
+                stamps.append(recv_into_timestamped(sock, slots[len(stamps)]))
+        except (BlockingIOError, sock_timeout) as err:
+            if not stamps:
+                raise NoData('NO DATA') from err
+        except OSError as err:
+            raise CanError("CAN read error: %s" % (err))
+
+        return self._raw_batch(stamps)
+
+    def _raw_batch(self, stamps):
+        """ Return the frames received into the first len(stamps) slots """
+        frames = self._raw_frames[:len(stamps)]
+        frames['can_id'] &= CAN_EFF_MASK
+        frames['timestamp'] = stamps
+        # Wall clock to monotonic, once for all frames
+        frames['timestamp'] += monotonic() - time()
+        return frames
+
+    def _recv_bcm(self):
+        """ Receive the next changed frame from the broadcast manager into
+            self._bcm_msg, skipping other notifications. Returns the frame
+            and the (wall clock) time the kernel received it. """
+        msg = self._bcm_msg
+        while True:
+            received = recv_into_timestamped(self._bcm_sock, msg)
+            if msg[:4].cast('I')[0] == CAN_BCM_RX_CHANGED:
+                return msg[BCMHDR.size:], received
+
+    def _read_bcm_frame(self, timeout):
+        """ read_raw_frame through the broadcast manager """
+        self._bcm_check_heartbeat()
+        try:
+            self._bcm_sock.settimeout(timeout)
+            frame, received = self._recv_bcm()
+            can_id, length, msg_data = CANFMT.unpack(frame)
+        except sock_timeout as err:
+            raise CanError("Recv timed out: %s" % (err))
+        except OSError as err:
+            raise CanError("CAN read error: %s" % (err))
+
+        return {
+            'can_id': can_id & CAN_EFF_MASK,
+            'data_len': length,
+            'data': msg_data[:length],
+            'timestamp': received - time() + monotonic(),
+            }
+
+    def _read_bcm_frames(self, timeout):
+        """ read_raw_frames through the broadcast manager """
+        self._bcm_check_heartbeat()
+        sock = self._bcm_sock
+        slots = self._raw_slots
+        stamps = []
+        try:
+            sock.settimeout(timeout)
+            while len(stamps) < RAW_BATCH:
+                frame, received = self._recv_bcm()
+                if not stamps:
+                    # Drain the frames already queued without waiting
+                    sock.settimeout(0)
+                slots[len(stamps)][:] = frame
+                stamps.append(received)
+        except (BlockingIOError, sock_timeout) as err:
+            if not stamps:
+                raise NoData('NO DATA') from err
+        except OSError as err:
+            raise CanError("CAN read error: %s" % (err))
+
+        return self._raw_batch(stamps)
+
+    def _bcm_setup(self, flt):
+        """ Install or renew the broadcast manager receive operation of one
+            filter. Renewing forgets the last content, so the next frame
+            is passed on even if unchanged. """
+        can_id = flt['id']
+        if can_id > 0x7ff or self._is_extended:
+            can_id |= CAN_EFF_FLAG
+        throttle_sec, throttle_usec = divmod(round(flt.get('throttle', 0) * 1e6), 1000000)
+        flags = CAN_BCM_SETTIMER
+        if flt.get('data_mask') is None:
+            # No content filtering, only the throttle applies
+            flags |= CAN_BCM_RX_FILTER_ID
+            frames = b''
+        else:
+            flags |= CAN_BCM_RX_CHECK_DLC
+            frames = CANFMT.pack(can_id, 8, bytes(flt['data_mask']))
+        head = BCMHDR.pack(CAN_BCM_RX_SETUP, flags, 0, 0, 0, throttle_sec, throttle_usec,
+                           can_id, 1 if frames else 0)
+        self._bcm_sock.send(head + frames)
+
+    def _bcm_delete(self, can_id):
+        """ Remove the broadcast manager receive operation of a can_id """
+        if can_id > 0x7ff or self._is_extended:
+            can_id |= CAN_EFF_FLAG
+        self._bcm_sock.send(BCMHDR.pack(CAN_BCM_RX_DELETE, 0, 0, 0, 0, 0, 0, can_id, 0))
+
+    def _bcm_check_heartbeat(self):
+        """ Renew the content filtered operations every bcm_heartbeat seconds
+            so unchanged signals are still seen now and then """
+        if not self._bcm_heartbeat:
+            return
+        now = monotonic()
+        if now < self._bcm_next_heartbeat:
+            return
+        self._bcm_next_heartbeat = now + self._bcm_heartbeat
+        try:
+            for flt in self._bcm_filters.values():
+                if flt.get('data_mask') is not None:
+                    self._bcm_setup(flt)
+        except OSError as err:
+            raise CanError("CAN BCM setup error: %s" % (err))
+
     def set_raw_mask(self, mask):
         """ Set the can receive mask of the raw socket"""
         self._can_raw_sock.set_can_rx_mask(mask)
@@ -322,8 +716,31 @@ class SocketCan:
         self._can_raw_sock.set_can_rx_filter(addr)
 
     def set_raw_filters_ex(self, filters):
-        """ Set filters on the socket of the raw socket """
-        self._can_raw_sock.set_filters_ex(filters)
+        """ Set filters on the socket of the raw socket. With the broadcast
+            manager enabled, filters must match exact ids and may have a
+            'data_mask' (up to 8 bytes, only frames with changes in these
+            bits are received) and a 'throttle' (min. seconds between two
+            received frames of the id). """
+        if self._bcm_sock is None:
+            self._can_raw_sock.set_filters_ex(filters)
+            return
+
+        filters = {flt['id']: flt for flt in filters}
+        for flt in filters.values():
+            full_mask = 0x7ff if flt['id'] <= 0x7ff and not self._is_extended else CAN_EFF_MASK
+            if flt['mask'] & full_mask != full_mask:
+                raise ValueError('CAN_BCM filters need exact ids, got mask %x for %x' %
+                                 (flt['mask'], flt['id']))
+
+        try:
+            for can_id in self._bcm_filters.keys() - filters.keys():
+                self._bcm_delete(can_id)
+            for flt in filters.values():
+                self._bcm_setup(flt)
+        except OSError as err:
+            raise CanError("CAN BCM setup error: %s" % (err))
+        self._bcm_filters = filters
+        self._bcm_next_heartbeat = monotonic() + self._bcm_heartbeat
 
     def set_protocol(self, prot):
         """ select the CAN flavor """
@@ -334,4 +751,5 @@ class SocketCan:
         else:
             raise ValueError('Unsupported protocol %s' % prot)
 
-        self.init_dongle()
+        # The link does not depend on the protocol
+        self.setup_sockets()
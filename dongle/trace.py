@@ -0,0 +1,224 @@
+""" Recording of CAN traffic and playback as a dongle """
+from struct import Struct
+from threading import Lock
+from time import monotonic, sleep
+import logging
+from . import NoData, CanError
+
+MAGIC = b'EVNTRACE1\n'
+# time since start, latency, kind, cantx or can_id, canrx, request length, response length
+RECORD = Struct('<dfcIIHH')
+RESPONSE = b'R'
+NODATA = b'N'
+CANERROR = b'E'
+FRAME = b'F'
+
+
+def read_trace(filename):
+    """ Yield the records of a trace file as
+        (time, latency, kind, cantx, canrx, cmd, response) """
+    with open(filename, 'rb') as trace:
+        if trace.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a trace file' % filename)
+
+        while True:
+            header = trace.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return     # end of file or truncated last record
+            stamp, latency, kind, cantx, canrx, cmd_len, resp_len = RECORD.unpack(header)
+            payload = trace.read(cmd_len + resp_len)
+            if len(payload) < cmd_len + resp_len:
+                return
+            yield stamp, latency, kind, cantx, canrx, payload[:cmd_len], payload[cmd_len:]
+
+
+class TraceRecorder:
+    """ Wraps a dongle and appends all requests with their responses and
+        all raw frames to a trace file """
+
+    def __init__(self, dongle, filename):
+        self._log = logging.getLogger("EVNotiPi/TraceRecorder")
+        self._dongle = dongle
+        self._file = open(filename, 'wb')
+        self._file.write(MAGIC)
+        self._lock = Lock()
+        self._start = monotonic()
+        # Only offer the bulk read if the dongle has it
+        if hasattr(dongle, 'read_raw_frames'):
+            self.read_raw_frames = self._read_raw_frames
+        self._log.info("Recording CAN trace to %s", filename)
+
+    def __getattr__(self, name):
+        return getattr(self._dongle, name)
+
+    def _write(self, start, kind, cantx, canrx, cmd, response):
+        with self._lock:
+            self._file.write(RECORD.pack(start - self._start, monotonic() - start, kind,
+                                         cantx, canrx, len(cmd), len(response)))
+            self._file.write(cmd)
+            self._file.write(response)
+            self._file.flush()
+
+    def send_command_ex(self, cmd, cantx, canrx, fc_opts=None):
+        """ Send a command and record the outcome """
+        start = monotonic()
+        try:
+            response = self._dongle.send_command_ex(cmd, cantx, canrx, fc_opts)
+        except NoData as err:
+            self._write(start, NODATA, cantx, canrx, cmd, str(err).encode())
+            raise
+        except CanError as err:
+            self._write(start, CANERROR, cantx, canrx, cmd, str(err).encode())
+            raise
+
+        self._write(start, RESPONSE, cantx, canrx, cmd, response)
+        return response
+
+    def read_raw_frame(self, timeout=None):
+        """ Read a single frame and record it """
+        frame = self._dongle.read_raw_frame(timeout)
+        # Stamp with the reception, not with the start of the wait
+        self._write(frame.get('timestamp', monotonic()), FRAME, frame['can_id'], 0, b'',
+                    frame['data'])
+        return frame
+
+    def _read_raw_frames(self, timeout=None):
+        """ Read all pending frames and record them """
+        frames = self._dongle.read_raw_frames(timeout)
+        for can_id, dlc, _, data, stamp in frames.tolist():
+            self._write(stamp, FRAME, can_id, 0, b'', data[:dlc])
+        return frames
+
+    def close(self):
+        """ Stop recording """
+        with self._lock:
+            self._file.close()
+
+
+class ReplayDongle:
+    """ Plays back a trace file. With speed 1 responses and frames are
+        delayed like in the recording, with speed 0 as fast as possible """
+
+    def __init__(self, config):
+        self._log = logging.getLogger("EVNotiPi/ReplayDongle")
+        self._speed = config.get('speed', 1.)
+        self._loop = config.get('loop', False)
+        self.supports_concurrency = config.get('concurrent', False)
+        self._lock = Lock()
+        # Outcomes of each request in recording order, by (cantx, cmd)
+        self._responses = {}
+        self._frames = []
+        for stamp, latency, kind, cantx, canrx, cmd, response in read_trace(config['file']):
+            if kind == FRAME:
+                self._frames.append((stamp, cantx, response))
+            else:
+                self._responses.setdefault((cantx, cmd), []).append(
+                    (stamp, latency, kind, response))
+        self._log.info("Replaying %d requests and %d frames from %s",
+                       sum(map(len, self._responses.values())), len(self._frames),
+                       config['file'])
+
+        self._filters = [{'id': 0, 'mask': 0}]
+        self._rewind()
+
+    def _rewind(self):
+        self._start = monotonic()
+        self._time = 0.
+        self._next_response = dict.fromkeys(self._responses, 0)
+        self._next_frame = 0
+
+    def _now(self):
+        """ Position in the trace """
+        if self._speed:
+            return (monotonic() - self._start) * self._speed
+        return self._time
+
+    def finished(self):
+        """ True if all recorded requests and frames were played back """
+        return (self._next_frame >= len(self._frames) and
+                all(self._next_response[key] >= len(outcomes)
+                    for key, outcomes in self._responses.items()))
+
+    def _wait(self, seconds):
+        if self._speed and seconds > 0:
+            sleep(seconds / self._speed)
+
+    def send_command_ex(self, cmd, cantx, canrx, fc_opts=None):
+        """ Return the recorded response to a request. At real speed the
+            most recent one, skipping those that were missed. """
+        key = (cantx, bytes(cmd))
+        with self._lock:
+            outcomes = self._responses.get(key)
+            if outcomes is None:
+                raise NoData('NO DATA')
+
+            idx = self._next_response[key]
+            if idx >= len(outcomes):
+                if not self._loop:
+                    raise NoData('NO DATA')
+                self._rewind()
+                idx = 0
+            if self._speed:
+                now = self._now()
+                while idx + 1 < len(outcomes) and outcomes[idx + 1][0] <= now:
+                    idx += 1
+            self._next_response[key] = idx + 1
+            stamp, latency, kind, response = outcomes[idx]
+            self._time = max(self._time, stamp)
+
+        self._wait(latency)
+        if kind == NODATA:
+            raise NoData(response.decode())
+        if kind == CANERROR:
+            raise CanError(response.decode())
+        return response
+
+    def read_raw_frame(self, timeout=None):
+        """ Return the next recorded frame passing the filters """
+        with self._lock:
+            idx = self._next_frame
+            while idx < len(self._frames) and not any(
+                    self._frames[idx][1] & f['mask'] == f['id'] & f['mask']
+                    for f in self._filters):
+                idx += 1
+            self._next_frame = idx
+
+            frame = None
+            if idx < len(self._frames):
+                stamp, can_id, payload = self._frames[idx]
+                delay = stamp - self._now()
+                if timeout is None or delay <= timeout * (self._speed or 1):
+                    frame = self._frames[idx]
+                    self._next_frame = idx + 1
+                    self._time = max(self._time, stamp)
+                elif not self._speed:
+                    self._time += timeout
+            elif self._loop:
+                self._rewind()
+
+        if frame is None:
+            if self._speed or idx >= len(self._frames):
+                sleep(timeout or 0)
+            raise NoData('NO DATA')
+
+        self._wait(delay)
+        return {
+            'can_id': can_id,
+            'data_len': len(payload),
+            'data': payload,
+            }
+
+    def set_raw_mask(self, mask):
+        """ Set the can receive mask of the raw frames """
+        self._filters = [{'id': self._filters[0]['id'], 'mask': mask}]
+
+    def set_raw_filter(self, addr):
+        """ Set the can receive filter of the raw frames """
+        self._filters = [{'id': addr, 'mask': self._filters[0]['mask']}]
+
+    def set_raw_filters_ex(self, filters):
+        """ Set filters of the raw frames """
+        self._filters = list(filters)
+
+    def set_protocol(self, prot):
+        """ Nothing to set up """
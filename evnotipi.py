@@ -84,6 +84,9 @@ watchdog = WATCHDOG(config['watchdog'])
 
 # Init dongle
 dongle = DONGLE(config['dongle'])
+if config['dongle'].get('record'):
+    from dongle.trace import TraceRecorder
+    dongle = TraceRecorder(dongle, config['dongle']['record'])
 
 # Init GPS interface
 gps = GpsPoller(config['gps'])
@@ -41,7 +41,7 @@ class InfluxTelemetry:
                             flush_interval=self._poll_interval * 1000,
                             jitter_interval=5000)
         self._iwrite = self._influx.write_api(write_options=opts)
-        self._car.register_data(self.data_callback)
+        self._car.register_data(self.data_callback, flat_arrays=True)
 
     def stop(self):
         """ Stop the submission thread """
@@ -49,7 +49,7 @@ class TelemetryProxy:
         log.debug('Starting thread')
         assert not self._running
         self._running = True
-        self._car.register_data(self.data_callback)
+        self._car.register_data(self.data_callback, flat_arrays=True)
         log.debug('Thread running')
 
     def stop(self):